@@ -1,12 +1,49 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, AsyncIterator
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
+from ..utils.output_parsers import OrjsonOutputParser
+from langchain_core.utils.json import parse_json_markdown
+from langchain_core.utils.json_schema import dereference_refs
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.messages import BaseMessage
 from pydantic.v1 import BaseModel, Field
+from langgraph.config import get_stream_writer
 from ..graphs.state import AgentState # Assuming AgentState is in src/state.py
+from ..utils.llm_cache import ExtractionCache, documents_digest, model_id
+from ..tools.document_loader import format_documents_for_prompt
+from ..tools.retriever import DocumentRetriever
+import asyncio
+import orjson
+import logging
 import pdb;
 
+logger = logging.getLogger(__name__)
+
+def _get_stream_writer():
+    """
+    Returns LangGraph's custom stream writer, or a no-op when not running inside a graph.
+    """
+    try:
+        return get_stream_writer()
+    except RuntimeError:
+        return lambda _: None
+
+# Content the LLM writes for a sub-section the documents say nothing about
+NO_INFORMATION_SENTINEL = "No information found"
+
+def section_has_information(state: AgentState) -> bool:
+    """
+    Returns False when the drafted section is empty, or every sub-section only says that no
+    information was found, so downstream generators can skip their LLM calls.
+    """
+    sub_sections = state.get("current_section_sub_sections") or []
+    if sub_sections:
+        return any(
+            (sub_section.get("content") or "").strip() and not (sub_section.get("content") or "").strip().startswith(NO_INFORMATION_SENTINEL)
+            for sub_section in sub_sections
+        )
+    content = (state.get("current_section_content") or "").strip()
+    return bool(content) and not content.startswith(NO_INFORMATION_SENTINEL)
+
 class SubSection(BaseModel):
     title: str = Field(description="The title of the sub-section.")
     content: str = Field(description="The content of the sub-section.")
@@ -14,23 +51,47 @@ class SubSection(BaseModel):
 class ExtractedSection(BaseModel):
     sub_sections: List[SubSection] = Field(description="A list of sub-sections within the main section.")
 
+class BatchExtraction(BaseModel):
+    sections: Dict[str, ExtractedSection] = Field(description="Extracted sub-sections keyed by section title.")
+
+def _response_schema(model) -> Dict[str, Any]:
+    """
+    Returns the JSON schema of a pydantic model with its $refs inlined, in the
+    shape Gemini accepts as a `response_schema` for constrained JSON decoding.
+    """
+    schema = dereference_refs(model.schema())
+    schema.pop("definitions", None)
+    return schema
+
 class ExtractorNode:
     """
     The ExtractorNode is responsible for performing an initial extraction of information
     for a given section from the loaded documents. It generates a first draft of the
     section content and identifies relevant references.
     """
-    def __init__(self, llm):
+    def __init__(self, llm, cache: Optional[ExtractionCache] = None, retriever: Optional[DocumentRetriever] = None):
         """
         Initializes the ExtractorNode with a language model.
 
         Args:
             llm: An instance of a LangChain-compatible language model.
+            cache (Optional[ExtractionCache]): Cache of previous extraction responses.
+                                               A default on-disk cache is used if not provided.
+            retriever (Optional[DocumentRetriever]): If provided, only the document chunks most relevant
+                                                     to the section are sent to the LLM instead of every document.
         """
         self.llm = llm
-        self.parser = JsonOutputParser()
+        self.cache = cache if cache is not None else ExtractionCache()
+        self.retriever = retriever
+        self.parser = OrjsonOutputParser()
+        # The documents come first so the long, invariant prefix can be reused by the provider's prompt cache
+        # across sections; everything section-specific follows it. They share one system message with the
+        # instructions, which a context-cached model can fold into the human message as a whole.
         self.prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert financial analyst. Your task is to extract relevant information from the provided documents to create a draft for the "{section_title}" section of a portfolio analysis report.
+            ("system", """Documents:
+{documents}
+
+            You are an expert financial analyst. Your task is to extract relevant information from the provided documents to create a draft for the "{section_title}" section of a portfolio analysis report.
 
             Focus on extracting factual information and key insights from the documents.
             You must structure your output as a JSON object with a single key: "sub_sections".
@@ -58,13 +119,56 @@ class ExtractorNode:
             Here are the formatting instructions:
             {format_instructions}
             """),
-            ("user", "Documents:\n{documents}\n\nSection Title: {section_title}\n{section_instruction}")
+            ("user", "Section Title: {section_title}\n{section_instruction}")
+        ])
+        # The format instructions are constant for this parser, so bind them into the prompt once
+        self._format_instructions = self.parser.get_format_instructions()
+        self.prompt = self.prompt.partial(format_instructions=self._format_instructions)
+        # Gemini's JSON mode constrains decoding to the ExtractedSection schema, so the response is
+        # bare JSON (never ```json fenced) that can be parsed and validated in a single pass.
+        self.json_llm = self.llm.bind(response_mime_type="application/json", response_schema=_response_schema(ExtractedSection))
+        self.chain = self.prompt | self.json_llm | self.parser
+        self.raw_chain = self.prompt | self.json_llm # Unparsed, for streaming
+        self.batch_prompt = ChatPromptTemplate.from_messages([
+            ("system", """Documents:
+{documents}
+
+            You are an expert financial analyst. Your task is to extract relevant information from the provided documents to create drafts for several sections of a portfolio analysis report in one pass.
+
+            Focus on extracting factual information and key insights from the documents.
+            You must structure your output as a JSON object with a single key: "sections".
+            The value of "sections" must be a JSON object keyed by the exact section title as given. Each value is a JSON object with a single key "sub_sections",
+            a list of JSON objects, where each object represents a sub-section and has two keys: "title" and "content".
+            The 'content' field MUST NOT contain any markdown formatting (e.g., ###, **, -, *, `). It should be plain text.
+
+            Treat each section independently and follow its own instruction. If you cannot find any relevant information for a section, return an empty list for its "sub_sections". Do not add any explanatory text outside of the JSON structure. Do not add markdown to the json output.
+
+            Example of desired output:
+            {{
+            "sections": {{
+                "Example Section Title 1": {{
+                "sub_sections": [
+                    {{
+                    "title": "Example Sub-Section Title",
+                    "content": "This is the extracted content for the sub-section without markdown."
+                    }}
+                ]
+                }},
+                "Example Section Title 2": {{
+                "sub_sections": []
+                }}
+            }}
+            }}
+            """),
+            ("user", "Sections:\n{sections}")
         ])
-        self.chain = self.prompt | self.llm
+        # The batch response is keyed by section title, which a response schema cannot express, so only JSON output is enforced
+        self.batch_chain = self.batch_prompt | self.llm.bind(response_mime_type="application/json") | self.parser
  
-    def extract(self, state: AgentState) -> Dict[str, Any]:
+    async def aextract(self, state: AgentState) -> Dict[str, Any]:
         """
         Extracts information for the current section from the documents.
+        Awaits the LLM call so that several sections can be extracted concurrently.
  
         Args:
             state (AgentState): The current state of the agent.
@@ -82,16 +186,14 @@ class ExtractorNode:
         if not documents:
             raise ValueError("No documents available in the agent state for extraction.")
  
-        # Format documents for the prompt
-        formatted_documents = "\n".join([
-            f"--- Document: {doc.get('filename', 'N/A')} ---\n"
-            f"{doc.get('content', 'Content not available')}"
-            for doc in documents
-        ])
+        formatted_documents = await self._documents_for_section(
+            current_section_title, current_section_instruction, documents, state.get("formatted_documents")
+        )
  
-        print(f"--- ExtractorNode: Extracting for section '{current_section_title}' ---")
-        # Log first 500 chars of documents for brevity
-        print(f"ExtractorNode: Input documents for '{current_section_title}':\n{formatted_documents[:1]}...")
+        logger.debug("--- ExtractorNode: Extracting for section '%s' ---", current_section_title)
+        # Log first 500 chars of documents for brevity, without slicing when debug logging is off
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("ExtractorNode: Input documents for '%s':\n%s...", current_section_title, formatted_documents[:500])
  
         
         try:
@@ -99,53 +201,59 @@ class ExtractorNode:
             extraction_input = {
                 "section_title": current_section_title,
                 "documents": formatted_documents,
-                "section_instruction": current_section_instruction,
-                "format_instructions": self.parser.get_format_instructions()
+                "section_instruction": current_section_instruction
             }
-            print(f"ExtractorNode: Invoking LLM for section '{current_section_title}'.")
-
-            # 2. Invoke the LLM
-            prompt_messages = self.prompt.format_messages(**extraction_input)
-            raw_llm_output = self.llm.invoke(prompt_messages)
-            # print(f"ExtractorNode: Raw LLM output for '{current_section_title}':\n---\n{raw_llm_output.content[:1]}\n---")
-
-            # 3. Clean the LLM output
-            cleaned_output = raw_llm_output.content.strip()
-            if cleaned_output.startswith("```json") and cleaned_output.endswith("```"):
-                cleaned_output = cleaned_output[len("```json"):-len("```")].strip()
-            elif cleaned_output.startswith("```") and cleaned_output.endswith("```"):
-                cleaned_output = cleaned_output[len("```"):-len("```")].strip()
-            # print(f"ExtractorNode: Cleaned LLM output for parsing:\n---\n{cleaned_output}\n---")
-
-            # 4. Parse the cleaned output into a dictionary
-            try:
-                parsed_dict = self.parser.parse(cleaned_output)
-            except Exception as parse_error:
-                error_message = f"ExtractorNode: JSON parsing failed for '{current_section_title}'. Raw output: {cleaned_output}. Error: {parse_error}"
-                print(error_message)
-                raise ValueError(error_message)
+            # 2. Check the cache, and only run the chain (without blocking the event loop) on a miss.
+            digest = documents_digest(documents)
+            cached_response = self.cache.get(model_id(self.llm), current_section_title, current_section_instruction, digest)
+            if cached_response is not None:
+                logger.debug("ExtractorNode: Cache hit for section '%s'. Skipping LLM call.", current_section_title)
+                parsed_dict = orjson.loads(cached_response)
+            else:
+                logger.debug("ExtractorNode: Invoking LLM for section '%s'.", current_section_title)
+                try:
+                    # Stream the response; the last partial parse is the complete result.
+                    # Completed sub-sections are surfaced on the graph's "custom" stream as they arrive.
+                    stream_writer = _get_stream_writer()
+                    surfaced_count = 0
+                    parsed_dict = None
+                    async for partial_dict in self.astream_extract(extraction_input):
+                        parsed_dict = partial_dict
+                        # The last sub-section may still be streaming, so only the ones before it are complete
+                        completed_sub_sections = (partial_dict.get("sub_sections") or [])[:-1] if isinstance(partial_dict, dict) else []
+                        if len(completed_sub_sections) > surfaced_count:
+                            surfaced_count = len(completed_sub_sections)
+                            stream_writer({"section": current_section_title, "partial_sub_sections": completed_sub_sections})
+                except Exception as parse_error:
+                    error_message = f"ExtractorNode: LLM call or JSON parsing failed for '{current_section_title}'. Error: {parse_error}"
+                    logger.error("%s", error_message)
+                    raise ValueError(error_message)
 
             if parsed_dict is None:
-                error_message = f"ExtractorNode: Parsed dictionary is None for '{current_section_title}'. Raw output: {cleaned_output}"
-                print(error_message)
+                error_message = f"ExtractorNode: Parsed dictionary is None for '{current_section_title}'."
+                logger.error("%s", error_message)
                 raise ValueError(error_message)
 
-            print(f"ExtractorNode: Parsed dictionary keys: {parsed_dict.keys()}")
+            logger.debug("ExtractorNode: Parsed dictionary keys: %s", parsed_dict.keys())
 
-            # 5. Manually create the Pydantic object for validation and structured access
+            # 3. Manually create the Pydantic object for validation and structured access
             try:
                 extraction_result = ExtractedSection(**parsed_dict)
             except Exception as pydantic_error:
                 error_message = f"ExtractorNode: Pydantic validation failed for '{current_section_title}': {pydantic_error}. Parsed dict: {parsed_dict}"
-                print(error_message)
+                logger.error("%s", error_message)
                 raise ValueError(error_message)
 
-            print(f"ExtractorNode: Pydantic model created successfully for '{current_section_title}': {type(extraction_result)}")
+            # Only cache responses that parsed and validated, so a bad response is retried next run
+            if cached_response is None:
+                self.cache.put(model_id(self.llm), current_section_title, current_section_instruction, digest, orjson.dumps(parsed_dict).decode())
+
+            logger.debug("ExtractorNode: Pydantic model created successfully for '%s': %s", current_section_title, type(extraction_result))
             sub_sections = extraction_result.sub_sections
-            print(f"ExtractorNode: Extracted {len(sub_sections)} sub-sections for '{current_section_title}'.")
+            logger.info("ExtractorNode: Extracted %d sub-sections for '%s'.", len(sub_sections), current_section_title)
 
             if not sub_sections:
-                print(f"ExtractorNode: Warning - No sub-sections were extracted for '{current_section_title}'. The LLM returned an empty list.")
+                logger.warning("ExtractorNode: Warning - No sub-sections were extracted for '%s'. The LLM returned an empty list.", current_section_title)
 
             references = [] # References are no longer generated by the extractor
  
@@ -154,17 +262,110 @@ class ExtractorNode:
             for sub_section in sub_sections:
                 formatted_content += f"### {sub_section.title}\n{sub_section.content}\n\n"
  
-            # 6. Update the state
+            # 4. Update the state
             return {
                 "current_section_content": formatted_content, # Populate with formatted content for reviewer
                 "current_section_sub_sections": [s.dict() for s in sub_sections], # Pass the structured sub_sections as dictionaries
                 "current_section_references": references,
-                "messages": state.get("messages", []) + [
+                "messages": [
                     BaseMessage(content=f"ExtractorNode: Initial draft for '{current_section_title}' created.", type="tool_output")
                 ]
             }
         except Exception as e:
             error_message = f"ExtractorNode: Error during extraction for '{current_section_title}': {e}"
-            print(error_message)
+            logger.error("%s", error_message)
             # It's better to raise the exception to let the graph's error handling manage it.
             raise
+
+    async def _documents_for_section(self, section_title: str, section_instruction: str, documents: List[Dict[str, Any]], formatted_documents: Optional[str] = None) -> str:
+        """
+        Returns the documents text to send for a section: the retrieved relevant chunks when a
+        retriever is configured, otherwise the documents formatted once per run.
+        """
+        if self.retriever is not None:
+            # Send only the chunks relevant to this section (the embedding lookup is a blocking call)
+            return await asyncio.to_thread(self.retriever.format_relevant_documents, f"{section_title}\n{section_instruction}")
+        # Documents are formatted once per run; only format here if the caller did not
+        return formatted_documents or format_documents_for_prompt(documents)
+
+    async def astream_extract(self, extraction_input: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streams the extraction chain, yielding the partially parsed JSON as tokens arrive
+        instead of waiting for the whole response.
+
+        Args:
+            extraction_input (Dict[str, Any]): The prompt inputs (section_title, documents, section_instruction).
+
+        Yields:
+            Dict[str, Any]: The JSON parsed so far. Each value supersedes the previous one.
+        """
+        # Chunks are collected in a list and only re-parsed when a JSON object or array may have
+        # just closed, rather than re-parsing the whole accumulated text on every chunk (O(n^2)).
+        chunks: List[str] = []
+        sub_sections_seen = 0
+        async for chunk in self.raw_chain.astream(extraction_input):
+            text = chunk.content if isinstance(chunk.content, str) else ""
+            if not text:
+                continue
+            chunks.append(text)
+            if text.rstrip()[-1:] not in ("}", "]"):
+                continue
+            try:
+                partial_dict = parse_json_markdown("".join(chunks))
+            except Exception:
+                continue
+            if isinstance(partial_dict, dict) and len(partial_dict.get("sub_sections") or []) != sub_sections_seen:
+                sub_sections_seen = len(partial_dict.get("sub_sections") or [])
+                logger.debug("ExtractorNode: '%s' has streamed %d sub-sections so far.", extraction_input.get("section_title"), sub_sections_seen)
+            yield partial_dict
+
+        # The complete response is parsed strictly once, so a truncated response raises instead of passing as partial.
+        # JSON mode returns bare JSON, so there are no markdown fences to strip first.
+        yield orjson.loads("".join(chunks))
+
+    async def aextract_batch(self, documents: List[Dict[str, Any]], sections: List[Dict[str, Any]], formatted_documents: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Extracts several sections from the documents with a single LLM call, so the
+        document text is only sent once for the whole batch. Each section's result is
+        written to the extraction cache, where `aextract` picks it up for that section.
+
+        Args:
+            documents (List[Dict[str, Any]]): The loaded documents.
+            sections (List[Dict[str, Any]]): The section definitions in this batch.
+            formatted_documents (Optional[str]): The documents already formatted for the prompt.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: The extracted sections keyed by section title. Sections the
+                                       LLM did not return are omitted and will be extracted individually.
+        """
+        section_titles = [section_info.get("name", "Untitled Section") for section_info in sections]
+        formatted_sections = "\n".join(
+            f"- Section Title: {section_info.get('name', 'Untitled Section')}\n"
+            f"  Instruction: {section_info.get('section_instructions', '')}"
+            for section_info in sections
+        )
+        if formatted_documents is None:
+            formatted_documents = format_documents_for_prompt(documents)
+
+        logger.debug("--- ExtractorNode: Batch extracting sections %s ---", section_titles)
+        try:
+            parsed_dict = await self.batch_chain.ainvoke({
+                "documents": formatted_documents,
+                "sections": formatted_sections
+            })
+            batch_result = BatchExtraction(**parsed_dict)
+        except Exception as e:
+            logger.warning("ExtractorNode: Batch extraction failed for %s, falling back to per-section extraction: %s", section_titles, e)
+            return {}
+
+        digest = documents_digest(documents)
+        extracted = {}
+        for section_info in sections:
+            section_title = section_info.get("name", "Untitled Section")
+            extraction_result = batch_result.sections.get(section_title)
+            if extraction_result is None:
+                logger.warning("ExtractorNode: Batch response did not include section '%s'.", section_title)
+                continue
+            extracted[section_title] = extraction_result.dict()
+            self.cache.put(model_id(self.llm), section_title, section_info.get("section_instructions", ""), digest, orjson.dumps(extracted[section_title]).decode())
+        return extracted
@@ -1,20 +1,36 @@
-from typing import Dict, Any, List
-from langchain_core.messages import BaseMessage
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
+from typing import Dict, Any, Optional
+import logging
+from langchain_core.messages import get_buffer_string
+from langchain_core.prompts import ChatPromptTemplate
+from ..utils.output_parsers import OrjsonOutputParser
+from langchain_core.exceptions import OutputParserException
 from ..graphs.state import AgentState
+from ..utils.llm_cache import ResponseCache, SemanticResponseCache, documents_digest, request_hash
+import asyncio
+from ..tools.document_loader import format_documents_for_prompt
+from ..tools.retriever import DocumentRetriever
+from .extractor import section_has_information
+
+logger = logging.getLogger(__name__)
 
 class GraphGeneratorNode:
     """
     Generates graph specifications (e.g., for D3.js, Chart.js, or a simple textual description)
     based on the extracted content and all available documents.
     """
-    def __init__(self, llm):
+    def __init__(self, llm, cache: Optional[ResponseCache] = None, semantic_cache: Optional[SemanticResponseCache] = None,
+                 retriever: Optional[DocumentRetriever] = None):
         self.llm = llm
-        self.parser = JsonOutputParser()
-        self.prompt = PromptTemplate(
-            template="""You are an expert at identifying and summarizing data suitable for graphical representation.
-            Given the following documents and the current section content, identify key data points
+        self.cache = cache if cache is not None else ResponseCache()
+        self.semantic_cache = semantic_cache # Optional; only used when an embeddings model is configured
+        self.retriever = retriever # Optional; sends only the chunks relevant to the section instead of every document
+        self.parser = OrjsonOutputParser()
+        # The documents are a leading system message of their own, so the long, invariant prefix can be
+        # reused by the provider's prompt cache; everything section-specific follows in the human message.
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", "All Documents:\n{documents}"),
+            ("human", """You are an expert at identifying and summarizing data suitable for graphical representation.
+            Given the documents above and the current section content, identify key data points
             that can be visualized and propose suitable graph types and their data structures.
             The output should be a JSON array of objects, where each object has a 'title', 'type' (e.g., 'bar', 'line', 'pie', 'textual_description'),
             and 'data' key. The 'data' key should contain the necessary data for the graph.
@@ -22,18 +38,14 @@ class GraphGeneratorNode:
             provide a clear description in the 'data' field for that object.
             Always attempt to generate at least one graph if relevant data is present. If no suitable data for any graph is found, return an empty array: [].
 
-            All Documents:
-            {documents}
-
             Current Section Title: {current_section}
             Current Section Content: {current_section_content}
-            Tabular Data for Current Section (if available): {tabular_data}
 
             Graph Instructions:
             {graph_instructions}
 
             Instructions:
-            - Analyze the content and tabular data for trends, comparisons, or distributions.
+            - Analyze the content and documents for trends, comparisons, or distributions.
             - Suggest a graph type that best represents the identified data. Never use stacked_bar
             - Provide the data in a structured format suitable for the chosen graph type.
             - The output MUST be a valid JSON array.
@@ -70,68 +82,86 @@ class GraphGeneratorNode:
                     "data": "The company has shown consistent growth in revenue over the last three quarters, with a slight dip in Q4 due to seasonal factors. Profit margins have remained stable."
                 }}
             ]
-            """,
-            input_variables=["documents", "current_section", "current_section_content", "tabular_data", "graph_instructions"],
-        )
-        self.chain = self.prompt | self.llm | self.parser
+            """)
+        ])
+        # Runs on a prompt that is already formatted: the prompt is formatted once per call for the
+        # cache key, and those same messages are sent to the LLM rather than re-templating the documents.
+        self.formatted_chain = self.llm | self.parser
 
-    def generate_graph(self, state: AgentState) -> Dict[str, Any]:
+    async def agenerate_graph(self, state: AgentState) -> Dict[str, Any]:
         """
         Generates graph specifications for the current section.
+        Awaits the LLM call so that other sections can progress concurrently.
+        Runs alongside the table generator, so it does not read `tabular_data`.
         """
-        print(f"--- Generating graph for section: '{state.get('current_section')}' ---")
-        documents_content = "\n\n".join([doc["content"] for doc in state.get("documents", [])])
+        logger.debug("--- Generating graph for section: '%s' ---", state.get('current_section'))
         current_section_content = state.get("current_section_content", "")
         current_section_title = state.get("current_section", "")
-        tabular_data = state.get("tabular_data", {}) # Get tabular data if available
+        if not section_has_information(state):
+            logger.info("Skipping graphs for empty section '%s'", current_section_title)
+            return {"graph_specs": []}
+        if self.retriever is not None:
+            # Rank chunks against the section and the start of its drafted content (the embedding lookup is a blocking call)
+            documents_content = await asyncio.to_thread(
+                self.retriever.format_relevant_documents, f"{current_section_title}\n{current_section_content[:1024]}"
+            )
+        else:
+            # Reuse the documents string formatted once per run (identical to the extractor's documents prefix)
+            documents_content = state.get("formatted_documents") or format_documents_for_prompt(state.get("documents", []))
         current_section_references = state.get("current_section_references", []) # Get references from writer
 
-        print(f"--- Debug: Input documents_content length: {len(documents_content)} ---")
+        logger.debug("--- Input documents_content length: %d ---", len(documents_content))
         # print(f"--- Debug: Input current_section_content length: {len(current_section_content)} ---")
-        # print(f"--- Debug: Input tabular_data: {tabular_data} ---")
 
         try:
-            # Temporarily modify the chain to get raw LLM output before parsing
-            raw_chain = self.prompt | self.llm
             graph_instructions = state.get("graph_instructions", "Only generate graphs of the most important data")
             if not graph_instructions.strip():
                 graph_instructions = "Only generate graphs of the most important data"
 
-            raw_llm_output = raw_chain.invoke({
+            graph_input = {
                 "documents": documents_content,
                 "current_section": current_section_title,
                 "current_section_content": current_section_content,
-                "tabular_data": tabular_data,
                 "graph_instructions": graph_instructions
-            })
-            print(f"--- Debug: Type of raw_llm_output: {type(raw_llm_output)} ---")
-            # print(f"--- Debug: Raw LLM Output: {raw_llm_output} ---")
-            # print(f"--- Debug: Type of raw_llm_output.content: {type(raw_llm_output.content)} ---")
-            
+            }
+            prompt_messages = self.prompt.format_messages(**graph_input)
+            cache_key = request_hash(get_buffer_string(prompt_messages), self.llm)
+            cached_graph_specs = self.cache.get(cache_key)
+            semantic_embedding = None
+            if cached_graph_specs is None and self.semantic_cache is not None:
+                semantic_digest = documents_digest(state.get("documents", []))
+                semantic_embedding = await asyncio.to_thread(
+                    self.semantic_cache.embed, f"{current_section_title}\n{graph_instructions}\n{documents_content[:2048]}"
+                )
+                cached_graph_specs = self.semantic_cache.lookup("graph", current_section_title, semantic_digest, semantic_embedding)
+            if cached_graph_specs is not None:
+                logger.debug("--- Graph cache hit for '%s'. Skipping LLM call. ---", current_section_title)
+                return {
+                    "graph_specs": cached_graph_specs,
+                }
+
             try:
-                graph_specs = self.parser.parse(raw_llm_output.content) # Parse the raw output, expecting a list
-                print(f"--- Debug: Type of graph_specs: {type(graph_specs)} ---")
+                graph_specs = await self.formatted_chain.ainvoke(prompt_messages) # Parsed by self.parser, expecting a list
+                logger.debug("--- Type of graph_specs: %s ---", type(graph_specs))
+                self.cache.put(cache_key, graph_specs)
+                if semantic_embedding is not None:
+                    self.semantic_cache.put("graph", current_section_title, semantic_digest, semantic_embedding, graph_specs)
                 # print(f"--- Graph specs generated for '{current_section_title}': {graph_specs} ---")
                 
                 # Return the list of graph_specs and ensure other relevant state variables are passed through
                 return {
                     "graph_specs": graph_specs, # Changed to graph_specs (plural)
                 }
-            except Exception as parse_error:
-                print(f"--- Error parsing LLM output for graph generation: {parse_error} ---")
-                print(f"--- Raw LLM output that caused parsing error: {raw_llm_output.content} ---")
-                import traceback
-                traceback.print_exc() # Print full traceback for parsing error
+            except OutputParserException as parse_error:
+                logger.exception("--- Error parsing LLM output for graph generation: %s ---", parse_error)
+                # The parser keeps the raw LLM output on the exception, so no second LLM call is needed to see it
+                logger.debug("--- Raw LLM output that caused parsing error: %s ---", parse_error.llm_output)
                 return {
                     "graph_specs": [], # Return empty list if parsing fails
                 }
  
         except Exception as e:
-            print(f"--- General error generating graph for section '{current_section_title}': {e} ---")
-            import traceback
-            traceback.print_exc() # Print full traceback for general errors
+            logger.exception("--- General error generating graph for section '%s': %s ---", current_section_title, e)
             return {
                 "graph_specs": [], # Return empty list if a general error occurs
-                "current_section_content": current_section_content,
-                "tabular_data": tabular_data
             }
\ No newline at end of file
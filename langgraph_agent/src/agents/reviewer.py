@@ -1,8 +1,12 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
-from langchain_core.messages import BaseMessage
+from ..utils.output_parsers import OrjsonOutputParser
+from langchain_core.messages import BaseMessage, get_buffer_string
+from ..utils.llm_cache import ResponseCache, request_hash
 from ..graphs.state import AgentState # Assuming AgentState is in src/state.py
+import logging
+
+logger = logging.getLogger(__name__)
 
 class ReviewerNode:
     """
@@ -10,14 +14,16 @@ class ReviewerNode:
     It provides feedback on what to expand, what to remove, and suggests search terms
     for further refinement by the WriterNode.
     """
-    def __init__(self, llm):
+    def __init__(self, llm, cache: Optional[ResponseCache] = None):
         """
         Initializes the ReviewerNode with a language model.
 
         Args:
             llm: An instance of a LangChain-compatible language model.
+            cache (Optional[ResponseCache]): Cache of parsed responses. A default on-disk cache is used if not provided.
         """
         self.llm = llm
+        self.cache = cache if cache is not None else ResponseCache()
         self.prompt = ChatPromptTemplate.from_messages([
             ("system", """You are an expert editor and financial analyst. Your task is to
              critique the provided section of a portfolio analysis report based *only* on the information present in the 'Section Content'.
@@ -45,12 +51,13 @@ class ReviewerNode:
              """),
             ("user", "Section Title: {section_title}\n\nSection Content:\n{section_content}\n{section_instruction}")
         ])
-        self.parser = JsonOutputParser()
-        self.chain = self.prompt | self.llm | self.parser
+        self.parser = OrjsonOutputParser()
+        self.formatted_chain = self.llm | self.parser
 
-    def review(self, state: AgentState) -> Dict[str, Any]:
+    async def areview(self, state: AgentState) -> Dict[str, Any]:
         """
         Reviews the current section's content and generates a critique.
+        Awaits the LLM call so that other sections can progress concurrently.
 
         Args:
             state (AgentState): The current state of the agent.
@@ -64,15 +71,15 @@ class ReviewerNode:
         current_section_references = state.get("current_section_references", []) # Get references directly from state
 
         if not current_section_title or not current_section_content:
-            print(f"ReviewerNode: No content found for section '{current_section_title}' to review. Skipping review.")
+            logger.debug("ReviewerNode: No content found for section '%s' to review. Skipping review.", current_section_title)
             return {
-                "messages": state.get("messages", []) + [
+                "messages": [
                     BaseMessage(content=f"ReviewerNode: No content to review for '{current_section_title}'.", type="info")
                 ],
                 "critique": None # Ensure critique is reset or remains None if no content
             }
 
-        print(f"--- ReviewerNode: Reviewing section '{current_section_title}' (Loop: {state.get('loop_count')}) ---")
+        logger.debug("--- ReviewerNode: Reviewing section '%s' (Loop: %s) ---", current_section_title, state.get('loop_count'))
 
         try:
             review_input = {
@@ -80,7 +87,14 @@ class ReviewerNode:
                 "section_content": current_section_content,
                 "section_instruction": current_section_instruction
             }
-            critique_result = self.chain.invoke(review_input)
+            prompt_messages = self.prompt.format_messages(**review_input)
+            cache_key = request_hash(get_buffer_string(prompt_messages), self.llm)
+            critique_result = self.cache.get(cache_key)
+            if critique_result is not None:
+                logger.debug("ReviewerNode: Cache hit for section '%s'. Skipping LLM call.", current_section_title)
+            else:
+                critique_result = await self.formatted_chain.ainvoke(prompt_messages)
+                self.cache.put(cache_key, critique_result)
 
             # Ensure the output matches the expected JSON structure
             critique = {
@@ -90,20 +104,19 @@ class ReviewerNode:
                 "search_terms": critique_result.get("search_terms", [])
             }
 
-            # Update the state with the critique, key highlights, and pass through content/references
+            # Update the state with the critique and key highlights; the unchanged content stays in state as is
             return {
                 "critique": critique,
                 "key_highlights": critique_result.get("key_highlights", []), # Add key_highlights to the state
-                "current_section_content": current_section_content, # Preserve content
-                "messages": state.get("messages", []) + [
+                "messages": [
                     BaseMessage(content=f"ReviewerNode: Critique for '{current_section_title}' generated.", type="tool_output")
                 ]
             }
         except Exception as e:
             error_message = f"ReviewerNode: Error during review for '{current_section_title}': {e}"
-            print(error_message)
+            logger.error("%s", error_message)
             return {
-                "messages": state.get("messages", []) + [
+                "messages": [
                     BaseMessage(content=error_message, type="error")
                 ],
                 "critique": None # Ensure critique is None on error
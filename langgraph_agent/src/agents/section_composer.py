@@ -0,0 +1,153 @@
+from typing import Dict, Any, List, Optional
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import PromptTemplate
+from pydantic.v1 import BaseModel, Field
+from ..graphs.state import AgentState
+from ..utils.llm_cache import ResponseCache, request_hash
+from ..utils.output_parsers import OrjsonOutputParser
+from ..tools.document_loader import format_documents_for_prompt
+from ..tools.retriever import DocumentRetriever
+from .extractor import ExtractorNode, SubSection
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class TableSpec(BaseModel):
+    title: str = Field(description="The title of the table.")
+    rows: List[Dict[str, Any]] = Field(description="The table rows, keyed by column header.")
+
+class GraphSpec(BaseModel):
+    title: str = Field(description="The title of the graph.")
+    type: str = Field(description="The graph type, e.g. 'bar', 'line', 'pie' or 'textual_description'.")
+    data: Any = Field(description="The graph data, or a description for 'textual_description'.")
+
+class SectionBundle(BaseModel):
+    sub_sections: List[SubSection] = Field(description="A list of sub-sections within the main section.")
+    table: Optional[TableSpec] = Field(None, description="The section's table, if one was requested.")
+    graph_specs: List[GraphSpec] = Field(default_factory=list, description="The section's graphs, if any were requested.")
+
+class SectionComposerNode:
+    """
+    Drafts a section's sub-sections, table and graphs with a single LLM call, so the
+    documents are sent (and paid for) once per section instead of once per node.
+    If the combined response fails, it falls back to the ExtractorNode; the table and
+    graph are then left unset so the separate generator nodes produce them.
+    """
+    def __init__(self, llm, extractor_node: ExtractorNode, cache: Optional[ResponseCache] = None,
+                 retriever: Optional[DocumentRetriever] = None):
+        """
+        Initializes the SectionComposerNode.
+
+        Args:
+            llm: An instance of a LangChain-compatible language model.
+            extractor_node (ExtractorNode): Used on its own when the combined call fails.
+            cache (Optional[ResponseCache]): Cache of parsed responses. A default on-disk cache is used if not provided.
+            retriever (Optional[DocumentRetriever]): If provided, only the document chunks most relevant
+                                                     to the section are sent to the LLM instead of every document.
+        """
+        self.llm = llm
+        self.extractor_node = extractor_node
+        self.cache = cache if cache is not None else ResponseCache()
+        self.retriever = retriever
+        self.parser = OrjsonOutputParser()
+        # The documents come first so the long, invariant prefix can be reused by the provider's prompt cache
+        self.prompt = PromptTemplate(
+            template="""All Documents:
+            {documents}
+
+            You are an expert financial analyst. Using the documents above, draft the "{current_section}" section of a portfolio analysis report,
+            together with its table and graphs, as a single JSON object with the keys "sub_sections", "table" and "graph_specs".
+
+            - "sub_sections": a list of objects with "title" and "content" keys. Extract factual information and key insights for the section.
+              The 'content' field MUST NOT contain any markdown formatting (e.g., ###, **, -, *, `). It should be plain text.
+              If you cannot find any relevant information for the section, return an empty list.
+            - "table": an object with "title" and "rows" keys, where each row is an object keyed by column header.
+              Focus on key financial metrics, operational data, and comparative figures, including time periods and growth rates where applicable.
+              Table request: {table_request}
+            - "graph_specs": a list of objects with "title", "type" (e.g., 'bar', 'line', 'pie', 'textual_description') and "data" keys.
+              For charts, "data" has "labels" and "datasets" (each with a "data" list, and a "label" where useful). Never use stacked_bar.
+              For 'textual_description', "data" is a clear description.
+              Graph request: {graph_request}
+
+            Section Instruction:
+            {section_instruction}
+
+            The output MUST be a valid JSON object with exactly these three keys. Do not add any explanatory text outside of the JSON structure.
+            """,
+            input_variables=["documents", "current_section", "section_instruction", "table_request", "graph_request"],
+        )
+        self.formatted_chain = self.llm.bind(response_mime_type="application/json") | self.parser
+
+    async def acompose(self, state: AgentState) -> Dict[str, Any]:
+        """
+        Drafts the current section with its table and graphs in one LLM call.
+
+        Args:
+            state (AgentState): The current state of the agent.
+
+        Returns:
+            Dict[str, Any]: The state update with the section content, sub-sections and, when requested,
+                            `tabular_data` and `graph_specs`.
+        """
+        current_section_title = state.get("current_section")
+        current_section_instruction = state.get("current_section_instruction", "")
+        include_table = state.get("include_table", False)
+        include_graphs = state.get("include_graphs", False)
+        if not current_section_title:
+            raise ValueError("No current section title specified in the agent state.")
+
+        if self.retriever is not None:
+            # Send only the chunks relevant to this section (the embedding lookup is a blocking call)
+            documents_content = await asyncio.to_thread(
+                self.retriever.format_relevant_documents, f"{current_section_title}\n{current_section_instruction}"
+            )
+        else:
+            documents_content = state.get("formatted_documents") or format_documents_for_prompt(state.get("documents", []))
+
+        table_instructions = (state.get("table_instructions") or "").strip() or "Table should not have more than 8 rows."
+        graph_instructions = (state.get("graph_instructions") or "").strip() or "Only generate graphs of the most important data"
+        prompt_text = self.prompt.format(
+            documents=documents_content,
+            current_section=current_section_title,
+            section_instruction=current_section_instruction,
+            table_request=table_instructions if include_table else 'Not requested; set "table" to null.',
+            graph_request=graph_instructions if include_graphs else 'Not requested; set "graph_specs" to [].',
+        )
+        cache_key = request_hash(prompt_text, self.llm)
+
+        try:
+            cached_response = self.cache.get(cache_key)
+            if cached_response is not None:
+                logger.debug("SectionComposerNode: Cache hit for section '%s'. Skipping LLM call.", current_section_title)
+                parsed_dict = cached_response
+            else:
+                logger.debug("SectionComposerNode: Invoking LLM for section '%s'.", current_section_title)
+                parsed_dict = await self.formatted_chain.ainvoke(prompt_text)
+            bundle = SectionBundle(**parsed_dict)
+        except Exception as e:
+            logger.warning("SectionComposerNode: Combined call failed for '%s', falling back to separate nodes: %s", current_section_title, e)
+            return await self.extractor_node.aextract(state)
+        # Only cache responses that validated, so a bad response is retried next run
+        if cached_response is None:
+            self.cache.put(cache_key, parsed_dict)
+
+        logger.info("SectionComposerNode: Composed %d sub-sections for '%s'.", len(bundle.sub_sections), current_section_title)
+        formatted_content = ""
+        for sub_section in bundle.sub_sections:
+            formatted_content += f"### {sub_section.title}\n{sub_section.content}\n\n"
+
+        update = {
+            "current_section_content": formatted_content,
+            "current_section_sub_sections": [s.dict() for s in bundle.sub_sections],
+            "current_section_references": [],
+            "messages": [
+                BaseMessage(content=f"SectionComposerNode: Section '{current_section_title}' composed with its table and graphs.", type="tool_output")
+            ]
+        }
+        # Only set the outputs that were requested; the router skips generators whose output is already present
+        if include_table:
+            update["tabular_data"] = bundle.table.dict() if bundle.table is not None else {"title": "", "rows": []}
+        if include_graphs:
+            update["graph_specs"] = [graph_spec.dict() for graph_spec in bundle.graph_specs]
+        return update
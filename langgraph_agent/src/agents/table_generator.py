@@ -1,25 +1,37 @@
-from typing import Dict, Any, List
-from langchain_core.messages import BaseMessage
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
+from typing import Dict, Any, Optional
+from langchain_core.messages import get_buffer_string
+from langchain_core.prompts import ChatPromptTemplate
+from ..utils.output_parsers import OrjsonOutputParser
 from ..graphs.state import AgentState
+from ..utils.llm_cache import ResponseCache, SemanticResponseCache, documents_digest, request_hash
+import asyncio
+import logging
+from ..tools.document_loader import format_documents_for_prompt
+from ..tools.retriever import DocumentRetriever
+from .extractor import section_has_information
+
+logger = logging.getLogger(__name__)
 
 class TableGeneratorNode:
     """
     Generates tabular data based on the extracted content and all available documents.
     """
-    def __init__(self, llm):
+    def __init__(self, llm, cache: Optional[ResponseCache] = None, semantic_cache: Optional[SemanticResponseCache] = None,
+                 retriever: Optional[DocumentRetriever] = None):
         self.llm = llm
-        self.parser = JsonOutputParser()
-        self.prompt = PromptTemplate(
-            template="""You are an expert financial analyst, skilled at extracting, summarizing, and presenting complex financial and business information in clear, concise, and well-structured tabular formats.
-            Given the following documents and the current section content, generate highly relevant and insightful tabular data
+        self.cache = cache if cache is not None else ResponseCache()
+        self.semantic_cache = semantic_cache # Optional; only used when an embeddings model is configured
+        self.retriever = retriever # Optional; sends only the chunks relevant to the section instead of every document
+        self.parser = OrjsonOutputParser()
+        # The documents are a leading system message of their own, so the long, invariant prefix can be
+        # reused by the provider's prompt cache; everything section-specific follows in the human message.
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", "All Documents:\n{documents}"),
+            ("human", """You are an expert financial analyst, skilled at extracting, summarizing, and presenting complex financial and business information in clear, concise, and well-structured tabular formats.
+            Given the documents above and the current section content, generate highly relevant and insightful tabular data
             The table should be in JSON format, with a 'title' and 'rows' key.
             Each row should be a dictionary where keys are column headers.
 
-            All Documents:
-            {documents}
-
             Current Section Title: {current_section}
             Current Section Content: {current_section_content}
 
@@ -54,31 +66,60 @@ class TableGeneratorNode:
                     {{"Metric": "Customer Acquisition Cost", "2023": "$50", "2024": "$45", "Change": "-$5"}}
                 ]
             }}
-            """,
-            input_variables=["documents", "current_section", "current_section_content", "table_instructions"],
-        )
-        self.chain = self.prompt | self.llm | self.parser
+            """)
+        ])
+        # Runs on a prompt that is already formatted: the prompt is formatted once per call for the
+        # cache key, and those same messages are sent to the LLM rather than re-templating the documents.
+        self.formatted_chain = self.llm | self.parser
 
-    def generate_table(self, state: AgentState) -> Dict[str, Any]:
+    async def agenerate_table(self, state: AgentState) -> Dict[str, Any]:
         """
         Generates tabular data for the current section.
+        Awaits the LLM call so that other sections can progress concurrently.
         """
-        print(f"--- Generating table for section: '{state.get('current_section')}' ---")
-        documents_content = "\n\n".join([doc["content"] for doc in state.get("documents", [])])
+        logger.debug("--- Generating table for section: '%s' ---", state.get('current_section'))
         current_section_content = state.get("current_section_content", "")
         current_section_title = state.get("current_section", "")
+        if not section_has_information(state):
+            logger.info("Skipping table for empty section '%s'", current_section_title)
+            return {"tabular_data": {"title": "", "rows": []}}
+        if self.retriever is not None:
+            # Rank chunks against the section and the start of its drafted content (the embedding lookup is a blocking call)
+            documents_content = await asyncio.to_thread(
+                self.retriever.format_relevant_documents, f"{current_section_title}\n{current_section_content[:1024]}"
+            )
+        else:
+            # Reuse the documents string formatted once per run (identical to the extractor's documents prefix)
+            documents_content = state.get("formatted_documents") or format_documents_for_prompt(state.get("documents", []))
         table_instructions = state.get("table_instructions", "Table should not have more than 8 rows.")
         if not table_instructions.strip():
             table_instructions = "Table should not have more than 8 rows."
 
         try:
-            tabular_data = self.chain.invoke({
+            table_input = {
                 "documents": documents_content,
                 "current_section": current_section_title,
                 "current_section_content": current_section_content,
                 "table_instructions": table_instructions
-            })
-            print(f"--- Table generated for '{current_section_title}' ---")
+            }
+            prompt_messages = self.prompt.format_messages(**table_input)
+            cache_key = request_hash(get_buffer_string(prompt_messages), self.llm)
+            tabular_data = self.cache.get(cache_key)
+            semantic_embedding = None
+            if tabular_data is None and self.semantic_cache is not None:
+                semantic_digest = documents_digest(state.get("documents", []))
+                semantic_embedding = await asyncio.to_thread(
+                    self.semantic_cache.embed, f"{current_section_title}\n{table_instructions}\n{documents_content[:2048]}"
+                )
+                tabular_data = self.semantic_cache.lookup("table", current_section_title, semantic_digest, semantic_embedding)
+            if tabular_data is not None:
+                logger.debug("--- Table cache hit for '%s'. Skipping LLM call. ---", current_section_title)
+            else:
+                tabular_data = await self.formatted_chain.ainvoke(prompt_messages)
+                self.cache.put(cache_key, tabular_data)
+                if semantic_embedding is not None:
+                    self.semantic_cache.put("table", current_section_title, semantic_digest, semantic_embedding, tabular_data)
+                logger.debug("--- Table generated for '%s' ---", current_section_title)
             # Append the generated table to the current section's content or a new field
             # For now, let's add it to a new 'tabular_data' field in the state.
             # We might want to integrate this into 'completed_sections' later.
@@ -91,7 +132,5 @@ class TableGeneratorNode:
             return result
 
         except Exception as e:
-            print(f"Error generating table for section '{current_section_title}': {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error generating table for section '%s': %s", current_section_title, e)
             return {} # Return empty dict to avoid breaking the graph
\ No newline at end of file
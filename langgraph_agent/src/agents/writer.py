@@ -1,16 +1,30 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, AsyncIterator
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
-from langchain_core.messages import BaseMessage
+from ..utils.output_parsers import OrjsonOutputParser
+from langchain_core.messages import BaseMessage, get_buffer_string
+from langchain_core.utils.json import parse_json_markdown
 from pydantic.v1 import BaseModel, Field
 from ..graphs.state import AgentState # Assuming AgentState is in src/state.py
+from .extractor import SubSection, _get_stream_writer # Shared with the extractor so both nodes emit the same sub-section schema
+from ..utils.llm_cache import ResponseCache, SemanticResponseCache, documents_digest, request_hash
+from ..tools.retriever import DocumentRetriever
+import asyncio
+import difflib
 import json # Added for json.dumps
-class SubSection(BaseModel):
-    title: str = Field(description="The title of the sub-section.")
-    content: str = Field(description="The content of the sub-section.")
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Matches an LLM response wrapped in a ```json ... ``` or ``` ... ``` code fence
+_FENCE_RE = re.compile(r"\A\s*```(?:json)?\s*(.*?)\s*```\s*\Z", re.DOTALL)
+
+# A rewrite at least this similar to the content it replaced has converged, so it is not re-reviewed
+REWRITE_CONVERGENCE_RATIO = 0.95
 
 class RewrittenSection(BaseModel):
     sub_sections: List[SubSection] = Field(description="A list of rewritten sub-sections within the main section.")
+    tabular_data: Optional[Dict[str, Any]] = Field(None, description="The section's table rebuilt for the rewrite, if requested.")
 
 class WriterNode:
     """
@@ -18,14 +32,32 @@ class WriterNode:
     from the ReviewerNode. It uses suggested search terms to find more information
     in the documents and generates an improved version of the section.
     """
-    def __init__(self, llm):
+    def __init__(self, llm, cache: Optional[ResponseCache] = None, semantic_cache: Optional[SemanticResponseCache] = None,
+                 retriever: Optional[DocumentRetriever] = None, rewrite_tables: bool = False):
         """
         Initializes the WriterNode with a language model.
 
         Args:
             llm: An instance of a LangChain-compatible language model.
+            cache (Optional[ResponseCache]): Cache of parsed responses. A default on-disk cache is used if not provided.
+            semantic_cache (Optional[SemanticResponseCache]): If provided, a rewrite of a near-identical request
+                                                              (e.g. a marginally different critique) is reused.
+            retriever (Optional[DocumentRetriever]): If provided, the new information for a rewrite is the document
+                                                     chunks most relevant to the critique's search terms, instead
+                                                     of keyword matches.
+            rewrite_tables (bool): If True, a section that includes a table gets its table rebuilt in the same
+                                   LLM call as the rewrite, instead of by a separate TableGeneratorNode call.
         """
         self.llm = llm
+        self.cache = cache if cache is not None else ResponseCache()
+        self.semantic_cache = semantic_cache
+        self.retriever = retriever
+        self.rewrite_tables = rewrite_tables
+        # Lower-cased document contents for the keyword search, computed once per documents list
+        self._lowered_documents = None
+        self._lowered_contents: List[str] = []
+        # Snippets found per search term; reviewers often repeat terms across sections and loops
+        self._term_snippets: Dict[str, List[str]] = {}
         self.prompt = ChatPromptTemplate.from_messages([
             ("system", """You are an expert financial report writer. Your task is to
              rewrite the provided section of a portfolio analysis report based on the
@@ -44,20 +76,22 @@ class WriterNode:
              and produce a significantly improved version of the section.
              Ensure to update references if new information is used.
  
-             Output your response as a JSON object with one key:
+             Output your response as a JSON object with the key:
              'sub_sections': A list of sub-section objects, each with a 'title' and 'content' key.
+             {table_request}
              Your output MUST be ONLY the JSON object, with no markdown.
              Example:
              {{"sub_sections": [{{"title": "Introduction", "content": "..."}}, {{"title": "Analysis", "content": "..."}}]}}
              """),
             ("user", "Section Title: {section_title}\n{section_instruction}")
         ])
-        self.parser = JsonOutputParser()
+        self.parser = OrjsonOutputParser()
         self.chain = self.prompt | self.llm
  
-    def rewrite(self, state: AgentState) -> Dict[str, Any]:
+    async def arewrite(self, state: AgentState) -> Dict[str, Any]:
         """
         Rewrites the current section's content based on critique and new information.
+        Awaits the LLM call so that other sections can progress concurrently.
 
         Args:
             state (AgentState): The current state of the agent.
@@ -78,9 +112,9 @@ class WriterNode:
         if not current_section_title:
             raise ValueError("No current section specified in the agent state.")
         if not critique:
-            print(f"WriterNode: No critique available for section '{current_section_title}'. Skipping rewrite.")
+            logger.debug("WriterNode: No critique available for section '%s'. Skipping rewrite.", current_section_title)
             return {
-                "messages": state.get("messages", []) + [
+                "messages": [
                     BaseMessage(content=f"WriterNode: No critique for '{current_section_title}'. Skipping rewrite.", type="info")
                 ]
             }
@@ -88,9 +122,9 @@ class WriterNode:
         # If there are no sub-sections, use the original_content string
         if not current_section_sub_sections:
             if not original_content:
-                print(f"WriterNode: No original content found for section '{current_section_title}'. Cannot rewrite.")
+                logger.warning("WriterNode: No original content found for section '%s'. Cannot rewrite.", current_section_title)
                 return {
-                    "messages": state.get("messages", []) + [
+                    "messages": [
                         BaseMessage(content=f"WriterNode: No original content for '{current_section_title}'. Cannot rewrite.", type="error")
                     ]
                 }
@@ -99,13 +133,19 @@ class WriterNode:
             # Convert Pydantic objects to dictionaries before dumping to JSON
             original_sub_sections_json = json.dumps(current_section_sub_sections)
  
-        print(f"--- WriterNode: Rewriting section '{current_section_title}' (Loop: {state.get('loop_count')}) ---")
+        logger.debug("--- WriterNode: Rewriting section '%s' (Loop: %s) ---", current_section_title, state.get('loop_count'))
  
         # Simulate targeted search based on critique's search terms
         # In a real implementation, this would involve a more sophisticated RAG approach
-        new_information = self._perform_targeted_search(documents, critique.get("search_terms", []))
+        search_terms = critique.get("search_terms", [])
+        if self.retriever is not None and search_terms:
+            # Retrieve the chunks relevant to the search terms (the embedding lookup is a blocking call)
+            new_information = await asyncio.to_thread(self.retriever.format_relevant_documents, "\n".join(search_terms))
+        else:
+            # The keyword scan over every document is CPU-bound, so keep it off the event loop
+            new_information = await asyncio.to_thread(self._perform_targeted_search, documents, search_terms)
         if new_information != "No new information found for search terms.":
-            print(f"WriterNode: New information found for '{current_section_title}'.")
+            logger.debug("WriterNode: New information found for '%s'.", current_section_title)
  
         try:
             rewrite_input = {
@@ -113,35 +153,59 @@ class WriterNode:
                 "critique": critique,
                 "original_sub_sections": original_sub_sections_json, # Pass structured sub-sections
                 "new_information": new_information,
-                "section_instruction": current_section_instruction
+                "section_instruction": current_section_instruction,
+                "table_request": self._table_request(state)
             }
-            raw_llm_output = self.llm.invoke(self.prompt.format_messages(**rewrite_input))
-            
-            # Clean the raw LLM output by removing markdown code block delimiters
-            cleaned_output = raw_llm_output.content.strip()
-            if cleaned_output.startswith("```json") and cleaned_output.endswith("```"):
-                cleaned_output = cleaned_output[len("```json"): -len("```")].strip()
-            elif cleaned_output.startswith("```") and cleaned_output.endswith("```"):
-                cleaned_output = cleaned_output[len("```"): -len("```")].strip()
- 
-            parsed_dict = self.parser.parse(cleaned_output)
+            prompt_messages = self.prompt.format_messages(**rewrite_input)
+            cache_key = request_hash(get_buffer_string(prompt_messages), self.llm)
+            cached_response = self.cache.get(cache_key)
+            semantic_embedding = None
+            if cached_response is None and self.semantic_cache is not None:
+                semantic_digest = documents_digest(state.get("documents", []))
+                semantic_embedding = await asyncio.to_thread(
+                    self.semantic_cache.embed, f"{current_section_title}\n{critique}\n{original_sub_sections_json[:2048]}"
+                )
+                cached_response = self.semantic_cache.lookup("writer", current_section_title, semantic_digest, semantic_embedding)
+
+            if cached_response is not None:
+                logger.debug("WriterNode: Cache hit for section '%s'. Skipping LLM call.", current_section_title)
+                parsed_dict = cached_response
+            else:
+                # Stream the response; the last value is the complete parse. Completed sub-sections are
+                # surfaced on the graph's "custom" stream as they arrive, as the extractor does.
+                stream_writer = _get_stream_writer()
+                surfaced_count = 0
+                parsed_dict = None
+                async for partial_dict in self.astream_rewrite(prompt_messages):
+                    parsed_dict = partial_dict
+                    # The last sub-section may still be streaming, so only the ones before it are complete
+                    completed_sub_sections = (partial_dict.get("sub_sections") or [])[:-1] if isinstance(partial_dict, dict) else []
+                    if len(completed_sub_sections) > surfaced_count:
+                        surfaced_count = len(completed_sub_sections)
+                        stream_writer({"section": current_section_title, "partial_sub_sections": completed_sub_sections})
  
             # Manually create the Pydantic object for validation
             try:
                 rewrite_result = RewrittenSection(**parsed_dict)
             except Exception as pydantic_error:
-                print(f"WriterNode: Pydantic validation failed for '{current_section_title}': {pydantic_error}")
+                logger.error("WriterNode: Pydantic validation failed for '%s': %s", current_section_title, pydantic_error)
                 raise
+
+            # Only cache responses that validated, so a bad response is retried next run
+            if cached_response is None:
+                self.cache.put(cache_key, parsed_dict)
+                if semantic_embedding is not None:
+                    self.semantic_cache.put("writer", current_section_title, semantic_digest, semantic_embedding, parsed_dict)
             
             rewritten_sub_sections = rewrite_result.sub_sections
-            print(f"WriterNode: Generated rewritten_sub_sections for '{current_section_title}': {rewritten_sub_sections}") # Debug print
+            logger.debug("WriterNode: Generated rewritten_sub_sections for '%s': %s", current_section_title, rewritten_sub_sections)
             
             # Fallback: If LLM returns empty sub_sections, create a default one from original content
             if not rewritten_sub_sections and original_content:
-                print(f"WriterNode: LLM returned empty sub_sections. Creating fallback sub-section from original content for '{current_section_title}'.")
+                logger.warning("WriterNode: LLM returned empty sub_sections. Creating fallback sub-section from original content for '%s'.", current_section_title)
                 rewritten_sub_sections = [{"title": "Content", "content": original_content}]
             elif not rewritten_sub_sections:
-                print(f"WriterNode: LLM returned empty sub_sections and no original content. Defaulting to empty list for '{current_section_title}'.")
+                logger.warning("WriterNode: LLM returned empty sub_sections and no original content. Defaulting to empty list for '%s'.", current_section_title)
                 rewritten_sub_sections = [] # Ensure it's an empty list if no content at all
  
             # Format sub_sections into a single markdown content string for the reviewer
@@ -152,28 +216,86 @@ class WriterNode:
                 markdown_content_for_review += f"### {sub_section.title}\n{sub_section.content}\n\n"
  
             updated_references = [] # References are no longer generated by the writer
+
+            # Another review round is only worth an LLM call if the rewrite actually changed the section.
+            # quick_ratio() is a cheap upper bound on ratio(), so most real rewrites skip the full diff.
+            matcher = difflib.SequenceMatcher(None, original_content, markdown_content_for_review)
+            needs_review = (matcher.quick_ratio() < REWRITE_CONVERGENCE_RATIO
+                            or matcher.ratio() < REWRITE_CONVERGENCE_RATIO)
+            if not needs_review:
+                logger.debug("WriterNode: Rewrite of '%s' converged; no further review needed.", current_section_title)
  
             # Update the specific section in completed_sections
             # Update the state, including incrementing loop_count
-            return {
+            update = {
                 "current_section_content": markdown_content_for_review, # Update current_section_content with markdown
                 "current_section_sub_sections": [s.dict() for s in rewritten_sub_sections], # Store structured sub-sections as dictionaries
                 "current_section_references": updated_references, # Store references separately
                 "key_highlights": critique.get("key_highlights", []), # Pass key_highlights from critique
                 "loop_count": state.get("loop_count", 0) + 1, # Increment loop_count here
-                "messages": state.get("messages", []) + [
+                "writer_needs_review": needs_review,
+                "messages": [
                     BaseMessage(content=f"WriterNode: Section '{current_section_title}' rewritten.", type="tool_output")
                 ]
             }
+            # A table from the rewrite replaces any earlier one. If none came back, the earlier table was
+            # built from the pre-review draft, so it is cleared and the router sends the section to the
+            # TableGeneratorNode to rebuild it from the rewritten content.
+            if self.rewrite_tables and state.get("include_table", False):
+                update["tabular_data"] = rewrite_result.tabular_data
+            return update
         except Exception as e:
             error_message = f"WriterNode: Error during rewrite for '{current_section_title}': {e}"
-            print(error_message)
+            logger.error("%s", error_message)
             return {
-                "messages": state.get("messages", []) + [
+                "messages": [
                     BaseMessage(content=error_message, type="error")
                 ]
             }
  
+    def _table_request(self, state: AgentState) -> str:
+        """
+        Returns the prompt line asking for the section's table alongside the rewrite, or an empty
+        string when tables are generated separately or the section has none.
+        """
+        if not (self.rewrite_tables and state.get("include_table", False)):
+            return ""
+        table_instructions = (state.get("table_instructions") or "").strip() or "Table should not have more than 8 rows."
+        return ("'tabular_data': A table for the rewritten section, as an object with a 'title' and a 'rows' list, "
+                "where each row is an object keyed by column header. Focus on key financial metrics and comparative figures. "
+                f"Table instructions: {table_instructions}")
+
+    async def astream_rewrite(self, prompt_messages: List[BaseMessage]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streams the rewrite, yielding the partially parsed JSON as tokens arrive.
+
+        Args:
+            prompt_messages (List[BaseMessage]): The formatted rewrite prompt.
+
+        Yields:
+            Dict[str, Any]: The JSON parsed so far. Each value supersedes the previous one, and the last
+                            is the strictly parsed complete response.
+        """
+        # Only re-parse when a JSON object or array may have just closed, not on every chunk
+        chunks: List[str] = []
+        async for chunk in self.llm.astream(prompt_messages):
+            text = chunk.content if isinstance(chunk.content, str) else ""
+            if not text:
+                continue
+            chunks.append(text)
+            if text.rstrip()[-1:] not in ("}", "]"):
+                continue
+            try:
+                partial_dict = parse_json_markdown("".join(chunks))
+            except Exception:
+                continue
+            yield partial_dict
+
+        # Clean the raw LLM output by removing markdown code block delimiters
+        raw_output = "".join(chunks)
+        fence_match = _FENCE_RE.match(raw_output)
+        yield self.parser.parse(fence_match.group(1) if fence_match else raw_output.strip())
+
     def _perform_targeted_search(self, documents: List[Dict[str, Any]], search_terms: List[str]) -> str:
         """
         Simulates a targeted search within documents based on search terms.
@@ -181,15 +303,28 @@ class WriterNode:
         """
         if not search_terms:
             return "No specific search terms provided."
- 
+
+        # The documents are the same list for every section and review loop, so each document is
+        # lower-cased once instead of once per search term per call.
+        if self._lowered_documents is not documents:
+            self._lowered_contents = [(doc.get("content") or "").lower() for doc in documents]
+            self._term_snippets = {}
+            self._lowered_documents = documents
+
         found_info = []
         for term in search_terms:
-            for doc in documents:
-                content = doc.get("content", "")
-                filename = doc.get("filename", "Unknown")
-                # Simple keyword search for demonstration
-                if term.lower() in content.lower():
-                    # In a real scenario, you'd extract relevant snippets, not whole content
-                    found_info.append(f"Found '{term}' in {filename}:\n{content[:200]}...") # Snippet
+            snippets = self._term_snippets.get(term)
+            if snippets is None:
+                snippets = []
+                term_lower = term.lower()
+                for doc, content_lower in zip(documents, self._lowered_contents):
+                    # Simple keyword search for demonstration
+                    position = content_lower.find(term_lower)
+                    if position != -1:
+                        content = doc.get("content") or ""
+                        snippet_start = max(0, position - 100)
+                        snippets.append(f"Found '{term}' in {doc.get('filename', 'Unknown')}:\n{content[snippet_start:snippet_start + 200]}...") # Snippet around the match
+                self._term_snippets[term] = snippets
+            found_info.extend(snippets)
         return "\n".join(found_info) if found_info else "No new information found for search terms."
  
@@ -1,59 +1,120 @@
-from typing import Dict, Any, List
+import asyncio
+import logging
+import os
+import tempfile
+from typing import Dict, Any, List, AsyncIterator, Optional, Union
 from langgraph.graph import StateGraph, END
 from langchain_core.messages import BaseMessage # Added SystemMessage for context caching
-from langchain_google_genai import ChatGoogleGenerativeAI # Using Gemini
 from .state import AgentState
 from ..agents.extractor import ExtractorNode
 from ..agents.table_generator import TableGeneratorNode
 from ..agents.graph_generator import GraphGeneratorNode
+from ..agents.section_composer import SectionComposerNode
 from ..agents.reviewer import ReviewerNode
 from ..agents.writer import WriterNode
-from ..tools.document_loader import load_documents_from_folder
+from ..tools.document_loader import format_documents_for_prompt
+from ..tools.retriever import DocumentRetriever, KeywordDocumentRanker
+from ..utils.llm_cache import ExtractionCache, ResponseCache, SemanticResponseCache
+from ..utils.context_cache import DocumentContextCache, cached_documents_placeholder
+
+logger = logging.getLogger(__name__)
 
 class PortfolioAnalysisGraph:
     """
     Defines the LangGraph state machine for the portfolio analysis agent.
     Orchestrates the Extractor, Reviewer, and Writer nodes in an iterative loop.
     """
-    def __init__(self, max_review_loops: int = 0):
+    def __init__(self, max_review_loops: int = 0, concurrency_limit: int = 4, extraction_batch_size: int = 1,
+                 embeddings: Any = None, retrieval_top_k: int = 8, max_document_tokens: Optional[int] = 800_000,
+                 fuse_section_calls: bool = False, documents_per_section: Optional[int] = None,
+                 use_context_cache: bool = False, generate_key_highlights: bool = True,
+                 reuse_cached_responses: bool = True):
         """
         Initializes the PortfolioAnalysisGraph with configuration.
         The LLM will be initialized within run_analysis to support context caching.
 
         Args:
             max_review_loops (int): The maximum number of times a section can be reviewed and rewritten.
+            concurrency_limit (int): The maximum number of sections processed at the same time.
+                                     Caps simultaneous LLM requests to avoid rate limiting (429s).
+            extraction_batch_size (int): The number of sections whose initial extraction is requested
+                                         in a single LLM call. 1 disables batching.
+            embeddings: An optional LangChain-compatible embeddings model. When set, the extractor
+                        and the table/graph generators send only the top `retrieval_top_k` document chunks
+                        for each section (the writer likewise retrieves chunks for the critique's search terms), and table/graph/writer responses are also cached semantically.
+            retrieval_top_k (int): The number of document chunks retrieved per section.
+            max_document_tokens (Optional[int]): Approximate token budget for the documents sent in each prompt,
+                                                 kept under Gemini's input window. None disables truncation.
+            fuse_section_calls (bool): Draft each section together with its table and graphs in one LLM call
+                                       (SectionComposerNode) instead of separate extractor, table and graph calls.
+                                       The separate nodes still run if the combined call fails. A rewrite
+                                       likewise rebuilds the section's table in the writer's own call.
+            documents_per_section (Optional[int]): When no embeddings model is set, send each section only the
+                                                   documents ranked highest for it by keyword (BM25) relevance
+                                                   instead of every document. Sections then no longer share one
+                                                   documents prefix, so batched extraction is skipped.
+                                                   None sends every document.
+            use_context_cache (bool): Upload the formatted documents to Gemini once per run as cached content,
+                                      so prompts reference the cache instead of carrying the documents.
+                                      Only applies when every section shares the same documents (no
+                                      embeddings model or per-section filtering); the documents are sent
+                                      inline if the cache cannot be created.
+            generate_key_highlights (bool): Whether each section is reviewed for its key highlights. With
+                                            `max_review_loops=0` the review is only needed for the highlights,
+                                            so setting this to False compiles a graph without the
+                                            reviewer/writer loop and saves one LLM call per section.
+            reuse_cached_responses (bool): Whether LLM responses cached on disk by earlier runs are reused.
+                                           When False, every LLM call is made again; the run caches its
+                                           responses in a temporary directory that is removed afterwards.
         """
         self.max_review_loops = max_review_loops
+        self.concurrency_limit = concurrency_limit
+        self.extraction_batch_size = extraction_batch_size
+        self.embeddings = embeddings
+        self.retrieval_top_k = retrieval_top_k
+        self.max_document_tokens = max_document_tokens
+        self.fuse_section_calls = fuse_section_calls
+        self.documents_per_section = documents_per_section
+        self.use_context_cache = use_context_cache
+        self.generate_key_highlights = generate_key_highlights
+        self.reuse_cached_responses = reuse_cached_responses
         # Nodes will be initialized in run_analysis with the cached LLM
         self.extractor_node = None
         self.reviewer_node = None
         self.writer_node = None
         self.table_generator_node = None
         self.graph_generator_node = None
-        self.graph = None # Graph will be built after LLM is ready
+        self.section_composer_node = None
+        self.graph = None # Compiled on the first run_analysis call and reused afterwards
+        self._docs = [] # Loaded documents for the current run, shared by every section's state
+        self._formatted_documents = ""
+        self._document_ranker = None # Set when documents are filtered per section
+        self.completed_sections = [] # Finalized sections of the current run, in completion order
 
     def _build_graph(self):
         """
-        Builds the LangGraph state machine. This method is now called
-        within run_analysis after the LLM and nodes are initialized.
+        Builds the LangGraph state machine. It is compiled once per PortfolioAnalysisGraph, on the
+        first run_analysis call; the graph nodes dispatch to the agent nodes of the current run,
+        so later runs (e.g. with another LLM) reuse the compiled graph.
         """
         # Initialize the StateGraph with the AgentState schema.
         # This defines the structure of the data that will be passed between nodes.
         workflow = StateGraph(AgentState)
 
         # Add nodes to the graph. Each node represents a step in our agent's workflow.
-        # "extractor": Uses the ExtractorNode to perform initial data extraction.
-        workflow.add_node("extractor", self.extractor_node.extract)
+        # "extractor": Uses the ExtractorNode to perform initial data extraction, or the SectionComposerNode
+        # to also draft the section's table and graphs in the same LLM call.
+        workflow.add_node("extractor", self._extract)
         # "reviewer": Uses the ReviewerNode to critique the extracted content.
-        workflow.add_node("reviewer", self.reviewer_node.review)
+        workflow.add_node("reviewer", self._review)
         # "writer": Uses the WriterNode to rewrite content based on critique.
-        workflow.add_node("writer", self.writer_node.rewrite)
+        workflow.add_node("writer", self._rewrite)
         # "table_graph_router": A router node to decide between table/graph generation.
         workflow.add_node("table_graph_router", self._table_graph_router_node) # Use a dedicated method
         # "table_generator": Generates tabular data for the section.
-        workflow.add_node("table_generator", self.table_generator_node.generate_table)
+        workflow.add_node("table_generator", self._generate_table)
         # "graph_generator": Generates graph specifications for the section.
-        workflow.add_node("graph_generator", self.graph_generator_node.generate_graph)
+        workflow.add_node("graph_generator", self._generate_graph)
 
         # Set the starting point of the graph.
         # The workflow will always begin by calling the "extractor" node.
@@ -62,18 +123,11 @@ class PortfolioAnalysisGraph:
         # Define the edges (transitions) between nodes.
         # Conditional edges allow the graph to choose the next node based on the state.
 
-        # After the "extractor" node runs, call the `_decide_next_step_after_extraction` function.
-        # This function will return a string ("review" or "next_section") which determines the next node.
-        workflow.add_conditional_edges(
-            "extractor",
-            self._decide_next_step_after_extraction,
-            {
-                # If the decider returns "review", transition to the "reviewer" node.
-                "review": "reviewer",
-                # If the decider returns "next_section", the current section's processing ends (END).
-                "next_section": END
-            }
-        )
+        # The first draft is always reviewed (unless the review would have no use), so this transition needs no decider.
+        if self.max_review_loops == 0 and not self.generate_key_highlights:
+            workflow.add_edge("extractor", "table_graph_router")
+        else:
+            workflow.add_edge("extractor", "reviewer")
 
         # After the "reviewer" node runs, call the `_decide_next_step_after_review` function.
         # This function will return a string ("rewrite" or "next_section").
@@ -97,7 +151,9 @@ class PortfolioAnalysisGraph:
             }
         )
 
-        # After table_graph_router, decide whether to generate tables, graphs or end
+        # After table_graph_router, decide whether to generate tables, graphs, both or end.
+        # When both are requested the decider returns both nodes, and LangGraph runs them
+        # concurrently in the same step; they write disjoint state keys.
         workflow.add_conditional_edges(
             "table_graph_router",
             self._decide_table_or_graph_generation, # This function is now the decider for this edge
@@ -108,39 +164,40 @@ class PortfolioAnalysisGraph:
             }
         )
 
-        # After table generation, decide whether to generate graphs or end
-        workflow.add_conditional_edges(
-            "table_generator",
-            self._decide_after_table_generation,
-            {
-                "graph_generator": "graph_generator",
-                END: END # Directly use END
-            }
-        )
-
-        # After graph generation, the section ends
+        # The section ends once the table and/or graph generation step has finished
+        workflow.add_edge("table_generator", END)
         workflow.add_edge("graph_generator", END)
 
         # Compile the workflow into a runnable LangGraph.
         # This prepares the graph for execution.
         return workflow.compile()
 
+    # The graph nodes look up the agent nodes at call time, since run_analysis creates them per run.
+    async def _extract(self, state: AgentState) -> Dict[str, Any]:
+        if self.section_composer_node is not None:
+            return await self.section_composer_node.acompose(state)
+        return await self.extractor_node.aextract(state)
+
+    async def _review(self, state: AgentState) -> Dict[str, Any]:
+        return await self.reviewer_node.areview(state)
+
+    async def _rewrite(self, state: AgentState) -> Dict[str, Any]:
+        return await self.writer_node.arewrite(state)
+
+    async def _generate_table(self, state: AgentState) -> Dict[str, Any]:
+        return await self.table_generator_node.agenerate_table(state)
+
+    async def _generate_graph(self, state: AgentState) -> Dict[str, Any]:
+        return await self.graph_generator_node.agenerate_graph(state)
+
     def _table_graph_router_node(self, state: AgentState) -> Dict[str, Any]:
         """
-        A router node that simply passes the state through.
+        A router node that leaves the state unchanged.
         Its purpose is to act as a point for conditional edges.
         """
-        print(f"--- Router: Entering table_graph_router for section '{state.get('current_section')}' ---")
-        return state # Return the current state to ensure it's always a dictionary
-
-    def _decide_next_step_after_extraction(self, state: AgentState) -> str:
-        """
-        Decider function: Determines the next step after the ExtractorNode has completed its run.
-        In this design, after the initial extraction, we always proceed to the ReviewerNode
-        to get feedback on the first draft.
-        """
-        print(f"--- Decider: After ExtractorNode for section '{state.get('current_section')}' ---")
-        return "review" # Always go to review after extraction
+        logger.debug("--- Router: Entering table_graph_router for section '%s' ---", state.get('current_section'))
+        # Nodes return only what they change; echoing the whole state back would rewrite every channel
+        return {}
 
     def _decide_next_step_after_review(self, state: AgentState) -> str:
         """
@@ -150,187 +207,286 @@ class PortfolioAnalysisGraph:
         If both conditions are met, it transitions to the WriterNode for refinement.
         Otherwise, it signals that the current section is complete and moves to the next section.
         """
-        print(f"--- Decider: After ReviewerNode for section '{state.get('current_section')}' ---")
+        section = state.get("current_section")
+        logger.debug("--- Decider: After ReviewerNode for section '%s' ---", section)
         critique = state.get("critique")
         loop_count = state.get("loop_count", 0)
-        # print(f"Decider: Critique content after ReviewerNode: {critique}") # Debug print
- 
-        if critique and (critique.get("expand_on") or critique.get("remove_or_rephrase")) and loop_count < self.max_review_loops:
-            print(f"--- Decider: Critique present for '{state.get('current_section')}'. Loops remaining ({loop_count}/{self.max_review_loops}). Proceeding to rewrite.")
+        max_loops = self.max_review_loops
+
+        # The loop limit is checked first; it is the cheapest test and usually decides the outcome
+        if loop_count < max_loops and critique and (critique.get("expand_on") or critique.get("remove_or_rephrase")):
+            logger.debug("--- Decider: Critique present for '%s'. Loops remaining (%s/%s). Proceeding to rewrite.", section, loop_count, max_loops)
             return "rewrite"
         else:
-            print(f"Decider: No actionable critique or max loops reached for '{state.get('current_section')}' ({loop_count}/{self.max_review_loops}). Proceeding to decide table/graph generation.")
+            logger.debug("Decider: No actionable critique or max loops reached for '%s' (%s/%s). Proceeding to decide table/graph generation.", section, loop_count, max_loops)
             return "generate_table_or_graph"
 
     def _decide_next_step_after_writer(self, state: AgentState) -> str:
         """
         Decider function: Determines the next step after the WriterNode has rewritten a section.
         It increments the `loop_count` for the current section.
-        If the `loop_count` is still below the `max_review_loops`, it transitions back to the
-        ReviewerNode for another round of critique and refinement.
+        If the `loop_count` is still below the `max_review_loops` and the rewrite actually changed
+        the section, it transitions back to the ReviewerNode for another round of critique and refinement.
         Otherwise, it signals that the current section has undergone enough review cycles
         and moves to the next section.
         """
-        print(f"--- Decider: After WriterNode for section '{state.get('current_section')}' ---")
+        section = state.get("current_section")
+        logger.debug("--- Decider: After WriterNode for section '%s' ---", section)
         loop_count = state.get("loop_count", 0)
-        # print(f"Decider: Sub-sections after WriterNode: {state.get('current_section_sub_sections', [])}") # Debug print
- 
+        max_loops = self.max_review_loops
+
         # After writing, if there's still a need for review (e.g., max loops not reached), go back to reviewer.
         # Otherwise, proceed to table generation.
-        if loop_count < self.max_review_loops:
-            print(f"Decider: Loops remaining for '{state.get('current_section')}' ({loop_count}/{self.max_review_loops}). Proceeding to re-review.")
+        if loop_count < max_loops and state.get("writer_needs_review", True):
+            logger.debug("Decider: Loops remaining for '%s' (%s/%s). Proceeding to re-review.", section, loop_count, max_loops)
             return "review"
         else:
-            print(f"Decider: Max loops reached for '{state.get('current_section')}' ({loop_count}/{self.max_review_loops}). Proceeding to decide table/graph generation.")
+            logger.debug("Decider: Max loops reached or rewrite converged for '%s' (%s/%s). Proceeding to decide table/graph generation.", section, loop_count, max_loops)
             return "generate_table_or_graph" # New transition to table/graph generation decider
 
-    def _decide_table_or_graph_generation(self, state: AgentState) -> str:
+    def _decide_table_or_graph_generation(self, state: AgentState) -> Union[str, List[str]]:
         """
-        Decider function: Determines whether to generate a table, a graph, or end the section.
-        This is called after the review/writer loop is complete.
+        Decider function: Determines whether to generate a table, a graph, both, or end the section.
+        This is called after the review/writer loop is complete. Table and graph generation
+        are independent of each other, so when both are requested they are run in parallel.
         """
-        print(f"--- Decider: Deciding table/graph generation for section '{state.get('current_section')}' ---")
-        include_table = state.get("include_table", False)
-        include_graphs = state.get("include_graphs", False)
-
-        if include_table:
-            print(f"Decider: 'include_table' is True. Proceeding to table generation for '{state.get('current_section')}'.")
-            return "table_generator"
-        elif include_graphs:
-            print(f"Decider: 'include_graphs' is True. Proceeding to graph generation for '{state.get('current_section')}'.")
-            return "graph_generator"
-        else:
-            print(f"Decider: Neither table nor graph generation requested for '{state.get('current_section')}'. Ending section.")
+        logger.debug("--- Decider: Deciding table/graph generation for section '%s' ---", state.get('current_section'))
+        # Outputs already produced by the SectionComposerNode are not generated again
+        next_nodes = []
+        if state.get("include_table", False) and state.get("tabular_data") is None:
+            next_nodes.append("table_generator")
+        if state.get("include_graphs", False) and state.get("graph_specs") is None:
+            next_nodes.append("graph_generator")
+
+        if not next_nodes:
+            logger.debug("Decider: Neither table nor graph generation requested for '%s'. Ending section.", state.get('current_section'))
             return END
+        logger.debug("Decider: Proceeding to %s for '%s'.", ' and '.join(next_nodes), state.get('current_section'))
+        return next_nodes
 
-    def _decide_after_table_generation(self, state: AgentState) -> str:
+    async def _prefetch_extractions(self, loaded_docs: List[Dict[str, Any]], formatted_documents: str, batch: List[Dict[str, Any]], semaphore: asyncio.Semaphore) -> None:
         """
-        Decider function: Determines whether to generate a graph after table generation, or end the section.
+        Extracts a batch of sections in one LLM call, warming the extractor cache
+        so each section's own extraction step does not need to call the LLM.
         """
-        print(f"--- Decider: After table generation for section '{state.get('current_section')}' ---")
-        include_graphs = state.get("include_graphs", False)
+        async with semaphore:
+            await self.extractor_node.aextract_batch(loaded_docs, batch, formatted_documents)
 
-        if include_graphs:
-            print(f"Decider: 'include_graphs' is True. Proceeding to graph generation for '{state.get('current_section')}'.")
-            return "graph_generator"
-        else:
-            print(f"Decider: 'include_graphs' is False. Ending section after table generation for '{state.get('current_section')}'.")
-            return END
+    def _section_state(self, section_info: Dict[str, Any]) -> AgentState:
+        """
+        Builds a fresh initial state for one section. The run-level documents are shared
+        by reference, so nothing from other sections is copied into the section's graph state.
+        """
+        documents, formatted_documents = self._docs, self._formatted_documents
+        if self._document_ranker is not None:
+            # Only the documents most relevant to this section are formatted into its prompts
+            documents = self._document_ranker.top_documents(
+                f"{section_info.get('name', '')}\n{section_info.get('section_instructions', '')}", self.documents_per_section
+            )
+            if documents is not self._docs:
+                formatted_documents = format_documents_for_prompt(documents, self.max_document_tokens)
+        return {
+            "documents": documents, # The run's documents (or this section's share of them), never copied.
+            "formatted_documents": formatted_documents, # Documents formatted once for all prompts.
+            "current_section": section_info.get("name", "Untitled Section"),
+            "current_section_instruction": section_info.get("section_instructions", ""),
+            "include_table": section_info.get("include_table", False),
+            "table_instructions": section_info.get("table_instructions", ""),
+            "include_graphs": section_info.get("include_graphs", False),
+            "graph_instructions": section_info.get("graph_instructions", ""),
+            "loop_count": 0, # Tracks review iterations for the current section.
+            "critique": None, # Stores feedback from the reviewer for the writer.
+            "key_highlights": [],
+            "current_section_sub_sections": [],
+            "tabular_data": None, # Stores generated tabular data for the current section.
+            "graph_specs": None, # Stores generated graph specifications for the current section (a list once generated).
+            "messages": [BaseMessage(content="Analysis started.", type="info")] # Log of agent's actions.
+        }
 
-    def run_analysis(self, llm: Any, loaded_docs: List[Dict[str, Any]], sections: List[Dict[str, Any]]):
+    async def _run_section(self, section_info: Dict[str, Any], semaphore: asyncio.Semaphore, prefetch: Optional[asyncio.Task] = None) -> Dict[str, Any]:
+        """
+        Runs the compiled graph for a single section and consolidates its final state.
+
+        Args:
+            section_info (Dict[str, Any]): The section definition (name, instructions, table/graph flags).
+            semaphore (asyncio.Semaphore): Limits how many sections run concurrently.
+            prefetch (Optional[asyncio.Task]): The batched extraction covering this section, if any.
+
+        Returns:
+            Dict[str, Any]: The finalized section, ready to be written to the report.
+        """
+        section_name = section_info.get("name", "Untitled Section")
+        section_instructions = section_info.get("section_instructions", "")
+        include_table = section_info.get("include_table", False)
+        table_instructions = section_info.get("table_instructions", "")
+        include_graphs = section_info.get("include_graphs", False)
+        graph_instructions = section_info.get("graph_instructions", "")
+
+        # Wait for the batched extraction outside the semaphore, since it needs a slot of its own.
+        if prefetch is not None:
+            await prefetch
+
+        async with semaphore:
+            logger.info("--- Starting analysis for section: '%s' with instruction: '%s' ---", section_name, section_instructions)
+            current_section_state = self._section_state(section_info)
+
+            # Run the graph for the current section
+            final_state_after_stream = None
+            # With stream_mode="values", LangGraph yields the full state after each step,
+            # with node updates already merged through the state's reducers (e.g. `add_messages`).
+            # "custom" carries partial sub-sections streamed by the extractor before it finishes.
+            # Pass max_concurrency explicitly; LangChain/LangGraph batch defaults can silently serialize calls.
+            async for stream_mode, s in self.graph.astream(current_section_state, config={"max_concurrency": self.concurrency_limit}, stream_mode=["values", "custom"]):
+                if stream_mode == "custom":
+                    logger.debug("--- Section '%s': %d sub-sections drafted so far ---", section_name, len(s.get('partial_sub_sections', [])))
+                    continue
+                final_state_after_stream = s
+                # print(f"--- Debug: State after stream step for '{section_name}': {s} ---")
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("--- Final state after stream for '%s': %s ---", section_name, final_state_after_stream)
+            logger.debug("--- current_section_content in final state: %s... ---", final_state_after_stream.get('current_section_content', '')[:500])
+        # print(f"--- Debug: current_section_sub_sections in final state: {final_state_after_stream.get('current_section_sub_sections', [])} ---")
+
+        # After the graph for a single section completes (reaches END),
+        # consolidate all relevant data for the current section.
+        finalized_section = {
+            "name": section_name,
+            "section_instructions": section_instructions, # Include the instruction in the finalized report
+            "content": final_state_after_stream.get("current_section_content", ""),
+            "sub_sections": final_state_after_stream.get("current_section_sub_sections", []),
+            "references": final_state_after_stream.get("current_section_references", []),
+            "key_highlights": final_state_after_stream.get("key_highlights", []), # Add key_highlights to the final section
+            "include_table": include_table,
+            "table_instructions": table_instructions,
+            "tabular_data": final_state_after_stream.get("tabular_data", None),
+            "include_graphs": include_graphs,
+            "graph_instructions": graph_instructions,
+            "graph_specs": final_state_after_stream.get("graph_specs") or []
+        }
+
+        logger.info("--- Finalized section '%s' ---", section_name)
+        return finalized_section
+
+    async def run_analysis(self, llm: Any, loaded_docs: List[Dict[str, Any]], sections: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
         """
         Executes the entire portfolio analysis process using the defined LangGraph.
-        It initializes the agent state with pre-loaded documents, and then iteratively processes
+        It initializes the agent state with pre-loaded documents, and then processes
         each specified section through the Extractor, Reviewer, and Writer nodes.
+        Sections are independent, so they run concurrently (bounded by `concurrency_limit`)
+        and are yielded in the order they complete.
 
         Args:
             loaded_docs (List[Dict[str, Any]]): A list of pre-loaded documents, each with 'filename', 'content', and 'metadata'.
-            sections (List[Dict[str, str]]): A list of dictionaries, where each dictionary contains
-                                            'title' (the section title) and 'instruction' (additional LLM instruction).
+            sections (List[Dict[str, Any]]): A list of structured section definitions, each with 'name',
+                                             'section_instructions', 'include_table', 'table_instructions',
+                                             'include_graphs' and 'graph_instructions'.
 
-        Returns:
-            List[Dict[str, Any]]: A list of dictionaries, where each dictionary represents
-                                  a fully processed and refined section of the analysis.
-                                  Each section includes its content and references.
+        Yields:
+            Dict[str, Any]: A fully processed and refined section of the analysis.
+                            Each section includes its content and references.
         """
         if not loaded_docs:
-            print("No documents provided. Exiting analysis.")
-            return []
+            logger.warning("No documents provided. Exiting analysis.")
+            return
+        if not all(isinstance(section_info, dict) for section_info in sections):
+            raise ValueError("Sections must be structured dictionaries (see DEFAULT_SECTIONS_TO_ANALYZE in run_agent.py).")
 
         # Initialize agent nodes with the provided LLM
-        self.extractor_node = ExtractorNode(llm)
-        self.reviewer_node = ReviewerNode(llm)
-        self.writer_node = WriterNode(llm)
-        self.table_generator_node = TableGeneratorNode(llm)
-        self.graph_generator_node = GraphGeneratorNode(llm)
+        # Embed the documents once per run so each section can retrieve only its relevant chunks
+        retriever = None
+        if self.embeddings is not None:
+            retriever = DocumentRetriever(self.embeddings, top_k=self.retrieval_top_k)
+            await asyncio.to_thread(retriever.index, loaded_docs)
+
+        # The documents do not change between sections, so format them for prompts only once.
+        formatted_documents = format_documents_for_prompt(loaded_docs, self.max_document_tokens)
+        self._document_ranker = None
+        if self.documents_per_section is not None and retriever is None:
+            self._document_ranker = KeywordDocumentRanker(loaded_docs)
+
+        # When every section sends the same documents, upload them once as Gemini cached content;
+        # prompts then carry a placeholder (with the documents' digest, for the response cache keys).
+        context_cache = None
+        if self.use_context_cache and retriever is None and self._document_ranker is None:
+            context_cache = DocumentContextCache(llm)
+            cached_llm = await context_cache.acreate(formatted_documents)
+            if cached_llm is not None:
+                llm = cached_llm
+                formatted_documents = cached_documents_placeholder(formatted_documents)
+
+        # Without reuse, responses are cached only for this run: batched extraction still hands
+        # each section its draft through the extraction cache.
+        run_cache_dir = None
+        if self.reuse_cached_responses:
+            extraction_cache, response_cache = ExtractionCache(), ResponseCache()
+            semantic_cache = SemanticResponseCache(self.embeddings) if self.embeddings is not None else None
+        else:
+            run_cache_dir = tempfile.TemporaryDirectory()
+            extraction_cache = ExtractionCache(os.path.join(run_cache_dir.name, ".extractor_cache.db"))
+            response_cache = ResponseCache(os.path.join(run_cache_dir.name, ".response_cache.db"))
+            semantic_cache = None
+
+        self.extractor_node = ExtractorNode(llm, cache=extraction_cache, retriever=retriever)
+        self.reviewer_node = ReviewerNode(llm, cache=response_cache)
+        # With fused calls the writer also rebuilds the table, so a rewritten section does not keep
+        # the composer's table of its first draft or need a separate table call.
+        self.writer_node = WriterNode(llm, cache=response_cache, semantic_cache=semantic_cache, retriever=retriever,
+                                      rewrite_tables=self.fuse_section_calls)
+        self.table_generator_node = TableGeneratorNode(llm, cache=response_cache, semantic_cache=semantic_cache, retriever=retriever)
+        self.graph_generator_node = GraphGeneratorNode(llm, cache=response_cache, semantic_cache=semantic_cache, retriever=retriever)
+        if self.fuse_section_calls:
+            self.section_composer_node = SectionComposerNode(llm, self.extractor_node, cache=response_cache, retriever=retriever)
         
-        # Build the graph now that nodes are initialized
-        self.graph = self._build_graph()
-        print("--- LangGraph built with cached LLM ---")
-
-        # Initialize the overall state for the agent.
-        initial_state: AgentState = {
-            "documents": loaded_docs, # All loaded documents available to all nodes.
-            "sections_to_process": sections, # List of sections to iterate through.
-            "completed_sections": [], # Accumulates the final versions of processed sections.
-            "current_section": None, # The section name currently being worked on by the graph.
-            "current_section_instruction": None, # The instruction for the current section.
-            "include_table": False, # Whether to include a table for the current section.
-            "table_instructions": "", # Instructions for table generation.
-            "include_graphs": False, # Whether to include graphs for the current section.
-            "graph_instructions": "", # Instructions for graph generation.
-            "loop_count": 0, # Tracks review iterations for the current section.
-            "critique": None, # Stores feedback from the reviewer for the writer.
-            "key_highlights": [], # Initialize key_highlights
-            "current_section_sub_sections": [], # New: Initialize sub_sections
-            "tabular_data": None, # Stores generated tabular data for the current section.
-            "graph_specs": [], # Stores generated graph specifications for the current section (now a list).
-            "messages": [BaseMessage(content="Analysis started.", type="info")] # Log of agent's actions.
-        }
+        # The compiled graph does not depend on this run's nodes, so it is only built once
+        if self.graph is None:
+            self.graph = self._build_graph()
+            logger.debug("--- LangGraph built ---")
 
-        # Iterate through each section defined in `sections_to_analyze`.
-        for section_info in sections:
-            section_name = section_info.get("name", "Untitled Section")
-            section_instructions = section_info.get("section_instructions", "")
-            include_table = section_info.get("include_table", False)
-            table_instructions = section_info.get("table_instructions", "")
-            include_graphs = section_info.get("include_graphs", False)
-            graph_instructions = section_info.get("graph_instructions", "")
-
-            print(f"\n--- Starting analysis for section: '{section_name}' with instruction: '{section_instructions}' ---")
-            # Create a copy of the initial state for the current section's processing.
-            current_section_state = initial_state.copy()
-            current_section_state["current_section"] = section_name
-            current_section_state["current_section_instruction"] = section_instructions
-            current_section_state["include_table"] = include_table
-            current_section_state["table_instructions"] = table_instructions
-            current_section_state["include_graphs"] = include_graphs
-            current_section_state["graph_instructions"] = graph_instructions
-            current_section_state["critique"] = None # Reset critique for each new section.
-            current_section_state["key_highlights"] = [] # Reset key_highlights for each new section.
-            current_section_state["loop_count"] = 0 # Reset loop count for each new section.
+        # Run-level inputs are read-only, so every section's state references them instead of copying them.
+        self._docs = loaded_docs
+        self._formatted_documents = formatted_documents
+        # Completed sections are collected here rather than in any graph state.
+        self.completed_sections = []
+        # Batched extraction sends every section the same documents, which filtered sections do not share
+        batch_extraction = not self.fuse_section_calls and self._document_ranker is None
 
-            # Run the graph for the current section
-            final_state_after_stream = None
-            for i, s in enumerate(self.graph.stream(current_section_state)):
-                # print(f"--- Debug: Stream yielded 's' at step {i} for '{section_name}': {s} ---")
-                # LangGraph stream yields a dictionary where the key is the node name
-                # and the value is the state update from that node.
-                # We need to unwrap this to get the actual state update.
-                node_output = list(s.values())[0]
-                current_section_state.update(node_output)
-                # It's crucial to ensure final_state_after_stream is updated with the latest state
-                final_state_after_stream = current_section_state.copy() # Create a copy to avoid reference issues
-                # print(f"--- Debug: State after stream step {i} for '{section_name}': {current_section_state} ---")
- 
-            print(f"--- Debug: Final state after stream for '{section_name}': {final_state_after_stream} ---")
-            print(f"--- Debug: current_section_content in final state: {final_state_after_stream.get('current_section_content', '')[:500]}... ---")
-            # print(f"--- Debug: current_section_sub_sections in final state: {final_state_after_stream.get('current_section_sub_sections', [])} ---")
-
-            # After the graph for a single section completes (reaches END),
-            # consolidate all relevant data for the current section and add it to completed_sections.
-            finalized_section = {
-                "name": section_name,
-                "section_instructions": section_instructions, # Include the instruction in the finalized report
-                "content": final_state_after_stream.get("current_section_content", ""),
-                "sub_sections": final_state_after_stream.get("current_section_sub_sections", []),
-                "references": final_state_after_stream.get("current_section_references", []),
-                "key_highlights": final_state_after_stream.get("key_highlights", []), # Add key_highlights to the final section
-                "include_table": include_table,
-                "table_instructions": table_instructions,
-                "tabular_data": final_state_after_stream.get("tabular_data", None),
-                "include_graphs": include_graphs,
-                "graph_instructions": graph_instructions,
-                "graph_specs": final_state_after_stream.get("graph_specs", [])
-            }
-            
-            print(f"--- Finalized section '{section_name}' ---")
-            yield finalized_section
-            
-            # Update the overall `initial_state` with the finalized section.
-            # This is crucial for subsequent sections to have access to previously
-            # completed sections if needed for context.
-            initial_state["completed_sections"].append(finalized_section)
- 
-        print("\n--- Portfolio Analysis Completed ---")
+        try:
+            # Sections are independent of each other, so schedule them all at once and
+            # let the semaphore cap how many are in flight against the LLM.
+            semaphore = asyncio.Semaphore(self.concurrency_limit)
 
+            # Optionally extract sections in batches so the documents are sent once per batch.
+            prefetches = [None] * len(sections)
+            # The combined per-section call does not use the extraction cache, so batching would not help it.
+            if self.extraction_batch_size > 1 and batch_extraction:
+                for start in range(0, len(sections), self.extraction_batch_size):
+                    batch = sections[start:start + self.extraction_batch_size]
+                    prefetch = asyncio.create_task(self._prefetch_extractions(loaded_docs, formatted_documents, batch, semaphore))
+                    prefetches[start:start + len(batch)] = [prefetch] * len(batch)
+
+            tasks = [
+                asyncio.create_task(self._run_section(section_info, semaphore, prefetch))
+                for section_info, prefetch in zip(sections, prefetches)
+            ]
+
+            for next_completed in asyncio.as_completed(tasks):
+                # A failing section is logged and left out of the report instead of aborting
+                # the run (and cancelling every other section's in-flight LLM calls).
+                try:
+                    finalized_section = await next_completed
+                except Exception as e:
+                    logger.exception("Section analysis failed: %s", e)
+                    continue
+                yield finalized_section
+
+                # Record the finalized section so the full set of completed
+                # sections is available once the run finishes.
+                self.completed_sections.append(finalized_section)
+ 
+            logger.info("--- Portfolio Analysis Completed ---")
+        finally:
+            if context_cache is not None:
+                await context_cache.adelete()
+            if run_cache_dir is not None:
+                run_cache_dir.cleanup()
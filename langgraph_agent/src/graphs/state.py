@@ -1,6 +1,7 @@
 from typing import List, Dict, Any, Optional
 from langchain_core.messages import BaseMessage
-from typing import List, Dict, Any, Optional, TypedDict
+from langgraph.graph.message import add_messages
+from typing import List, Dict, Any, Optional, TypedDict, Annotated
 
 class AgentState(TypedDict):
     """
@@ -10,12 +11,17 @@ class AgentState(TypedDict):
         documents (List[Dict[str, Any]]): A list of dictionaries, where each dictionary
                                           represents a loaded document. Each document
                                           should have at least 'content' and 'metadata' keys.
-        sections_to_process (List[str]): A list of section titles that still need to be
-                                         processed by the agent (e.g., "Overview", "Financial Review").
+        formatted_documents (str): The documents formatted once per run for inclusion in prompts.
+        sections_to_process (List[Dict[str, Any]]): The section definitions to be processed by the agent.
+                                                    Each has 'name' (e.g., "Overview", "Financial Review"),
+                                                    'section_instructions', 'include_table', 'table_instructions',
+                                                    'include_graphs' and 'graph_instructions'.
         completed_sections (List[Dict[str, Any]]): A list of dictionaries, where each
                                                    dictionary represents a completed section
                                                    of the analysis, including its content,
                                                    sub_sections, references, key_highlights, and any other relevant metadata.
+                                                   Not set in per-section graph runs; PortfolioAnalysisGraph
+                                                   collects completed sections outside the graph state.
         current_section (Optional[str]): The title of the section currently being processed.
                                          None if no section is currently active.
         current_section_instruction (Optional[str]): Additional instruction for the LLM for the current section.
@@ -27,13 +33,18 @@ class AgentState(TypedDict):
         key_highlights (List[str]): A list of key highlights extracted from the current section.
         messages (List[BaseMessage]): A list of messages exchanged during the agent's
                                        execution, useful for debugging and tracing.
+                                       Nodes return only their new messages; the `add_messages`
+                                       reducer appends them to the existing list.
         current_section_content (Optional[str]): The content of the current section being processed.
         current_section_references (List[Dict[str, Any]]): References for the current section.
+        writer_needs_review (bool): Whether the writer's last rewrite changed the section enough
+                                    to be worth another review round.
         tabular_data (Optional[Dict[str, Any]]): Stores generated tabular data for the current section.
         graph_specs (Optional[List[Dict[str, Any]]]): Stores a list of generated graph specifications for the current section.
     """
     documents: List[Dict[str, Any]]
-    sections_to_process: List[Dict[str, str]] # Updated to expect dicts with title and instruction
+    formatted_documents: str # Precomputed once per run from `documents`
+    sections_to_process: List[Dict[str, Any]] # Structured section definitions (see run_agent.DEFAULT_SECTIONS_TO_ANALYZE)
     completed_sections: List[Dict[str, Any]] # Each item will now include 'key_highlights'
     current_section: Optional[str]
     current_section_instruction: Optional[str]
@@ -47,6 +58,7 @@ class AgentState(TypedDict):
     current_section_content: Optional[str]
     current_section_references: List[Dict[str, Any]]
     current_section_sub_sections: List[Dict[str, Any]] # Added to persist structured sub-sections
+    writer_needs_review: bool # Set by the writer; False once a rewrite has converged
     tabular_data: Optional[Dict[str, Any]]
     graph_specs: Optional[List[Dict[str, Any]]] # Changed to graph_specs (plural) and type to List
-    messages: List[BaseMessage]
\ No newline at end of file
+    messages: Annotated[List[BaseMessage], add_messages]
\ No newline at end of file
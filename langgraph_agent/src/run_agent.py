@@ -1,13 +1,16 @@
 import os
-import json
+import orjson
+import asyncio
 import datetime
-import sys # Import sys to access command-line arguments
+import argparse
+import atexit
+import logging
+import logging.handlers
+import queue
+from pathlib import Path
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI # Example LLM
-from src.graphs.main_graph import PortfolioAnalysisGraph
-from src.utils.excel_to_csv_utils import convert_excel_to_csv
-from src.tools.document_loader import load_documents_from_folder
-from src.utils.report_generator import generate_html_report
+# Heavy modules (LangChain, Gemini client, pandas, PDF/Excel readers, Jinja) are imported
+# inside the functions that use them, so fast-fail paths (missing API key, bad folder) stay quick.
 
 DEFAULT_SECTIONS_TO_ANALYZE = [
     {
@@ -56,6 +59,10 @@ def _initialize_environment():
     """
     Loads environment variables and initializes the Google Generative AI LLM.
 
+    The returned instance is the single client shared by every node and section for the whole run.
+    It talks to Gemini over gRPC, which keeps one persistent HTTP/2 channel per client and
+    multiplexes concurrent section requests over it instead of opening a connection per call.
+
     Returns:
         ChatGoogleGenerativeAI: Initialized LLM instance.
     
@@ -66,8 +73,27 @@ def _initialize_environment():
     google_api_key = os.getenv("GOOGLE_API_KEY")
     if not google_api_key:
         raise ValueError("Error: GOOGLE_API_KEY not found in environment variables. Please set it in a .env file or directly in your environment.")
-    
-    return ChatGoogleGenerativeAI(model="gemini-2.5-flash-preview-05-20", google_api_key=google_api_key)
+
+    from langchain_google_genai import ChatGoogleGenerativeAI # Example LLM
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.5-flash-preview-05-20",
+        google_api_key=google_api_key,
+        transport="grpc" # Persistent, multiplexed channel (async calls use the grpc_asyncio equivalent)
+    )
+
+def _initialize_embeddings(model: str):
+    """
+    Initializes the Google Generative AI embeddings model used for per-section retrieval.
+    Call after `_initialize_environment`, which loads and checks GOOGLE_API_KEY.
+
+    Args:
+        model (str): The embeddings model name, e.g. "models/text-embedding-004".
+
+    Returns:
+        GoogleGenerativeAIEmbeddings: Initialized embeddings instance.
+    """
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model=model, google_api_key=os.getenv("GOOGLE_API_KEY"))
 
 def _prepare_data_folder(data_folder: str):
     """
@@ -79,16 +105,16 @@ def _prepare_data_folder(data_folder: str):
     Raises:
         FileNotFoundError: If the data folder does not exist.
     """
-    if not os.path.exists(data_folder):
+    data_path = Path(data_folder)
+    if not data_path.exists():
         raise FileNotFoundError(f"Error: Data folder '{data_folder}' not found. Please ensure the folder exists.")
 
+    from src.utils.excel_to_csv_utils import convert_excel_to_csv
+
     print(f"Checking for .xlsx files in '{data_folder}' to convert to .csv...")
-    for root, _, files in os.walk(data_folder):
-        for file in files:
-            if file.endswith(".xlsx"):
-                excel_file_path = os.path.join(root, file)
-                print(f"Found Excel file: {excel_file_path}. Converting to CSV...")
-                convert_excel_to_csv(excel_file_path, root) # Convert in place
+    for excel_file_path in data_path.rglob("*.xlsx"):
+        print(f"Found Excel file: {excel_file_path}. Converting to CSV...")
+        convert_excel_to_csv(str(excel_file_path), str(excel_file_path.parent)) # Convert in place
     print("Excel to CSV conversion complete (if any .xlsx files were found).")
 
 def _load_and_display_documents(data_folder: str):
@@ -104,7 +130,13 @@ def _load_and_display_documents(data_folder: str):
     Raises:
         ValueError: If no documents are found in the data folder.
     """
-    loaded_docs = load_documents_from_folder(data_folder)
+    from src.tools.document_loader import load_documents_from_folder, deduplicate_documents
+    from src.utils.llm_cache import DocumentCache
+
+    # Files unchanged since the last run are read from the document cache instead of being parsed again
+    loaded_docs = load_documents_from_folder(data_folder, max_workers=min(8, os.cpu_count() or 1), cache=DocumentCache())
+    # Drop repeated documents and boilerplate once here, so every prompt carries fewer tokens
+    loaded_docs = deduplicate_documents(loaded_docs)
     if not loaded_docs:
         raise ValueError("No documents found in the data folder. Exiting.")
     
@@ -113,52 +145,82 @@ def _load_and_display_documents(data_folder: str):
         print(f"- {doc['filename']} (Type: {doc['metadata'].get('type', 'unknown')})")
     return loaded_docs
 
-def _execute_analysis_and_save_report(llm, loaded_docs, sections_to_analyze, output_dir):
+def _execute_analysis_and_save_report(llm, loaded_docs, sections_to_analyze, output_dir, graph_options=None):
     """
-    Executes the portfolio analysis and saves the incremental JSON report.
+    Executes the portfolio analysis and saves the incremental JSONL report.
+    Sections are analyzed concurrently and each one is written as its own line as soon as it completes,
+    so the file stays valid even if the run is interrupted.
 
     Args:
         llm: The initialized LLM instance.
         loaded_docs (list): List of loaded documents.
         sections_to_analyze (list): List of sections to analyze.
         output_dir (str): Directory to save the report.
+        graph_options (dict, optional): Keyword arguments for PortfolioAnalysisGraph, overriding the defaults.
 
     Returns:
-        str: The path to the generated JSON report file.
+        tuple: The path to the generated JSONL report file and the list of section reports.
     """
-    agent_graph = PortfolioAnalysisGraph(max_review_loops=1)
+    from src.graphs.main_graph import PortfolioAnalysisGraph
+
+    agent_graph = PortfolioAnalysisGraph(**{"max_review_loops": 1, **(graph_options or {})})
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_file = os.path.join(output_dir, f"portfolio_analysis_report_{timestamp}.json")
+    output_file = os.path.join(output_dir, f"portfolio_analysis_report_{timestamp}.jsonl")
     
     print(f"Starting portfolio analysis and writing incremental report to '{output_file}'...")
     
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write("[\n")
-        first_section = True
-        for section_report in agent_graph.run_analysis(llm, loaded_docs, sections_to_analyze):
-            if not first_section:
-                f.write(",\n")
-            json.dump(section_report, f, indent=2)
-            first_section = False
-        f.write("\n]\n")
-        
+    section_reports = []
+
+    async def _drive():
+        with open(output_file, "ab") as f:
+            async for section_report in agent_graph.run_analysis(llm, loaded_docs, sections_to_analyze):
+                f.write(orjson.dumps(section_report) + b"\n")
+                f.flush()
+                section_reports.append(section_report)
+
+    asyncio.run(_drive())
+
     print(f"\nPortfolio analysis completed. Report saved to '{output_file}'")
-    return output_file
+    return output_file, section_reports
 
-def _generate_html_report(json_report_path: str, output_dir: str):
+def _generate_html_report(json_report_path: str, output_dir: str, section_reports: list = None):
     """
-    Generates an HTML report from the JSON report.
+    Generates an HTML report from the JSONL report.
 
     Args:
-        json_report_path (str): Path to the JSON report file.
+        json_report_path (str): Path to the JSONL report file.
         output_dir (str): Directory to save the HTML report.
+        section_reports (list, optional): The section reports already in memory. When provided,
+                                          the JSON report is not read back from disk.
     """
+    from src.utils.report_generator import generate_html_report
+
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     html_output_file = os.path.join(output_dir, f"portfolio_analysis_report_{timestamp}.html")
-    generate_html_report(json_report_path, html_output_file)
+    generate_html_report(json_report_path, html_output_file, report_data=section_reports)
     print(f"HTML report generated and saved to '{html_output_file}'")
 
-def run_portfolio_analysis(folder_name: str, sections_to_analyze: list = None):
+def _load_sections_config(config_path: str) -> list:
+    """
+    Loads section definitions from a JSON file.
+
+    Args:
+        config_path (str): Path to a JSON file containing a list of section dictionaries
+                           in the same shape as DEFAULT_SECTIONS_TO_ANALYZE.
+
+    Returns:
+        list: The section definitions.
+
+    Raises:
+        ValueError: If the file does not contain a list of section dictionaries.
+    """
+    sections = orjson.loads(Path(config_path).read_bytes())
+    if not isinstance(sections, list) or not all(isinstance(section, dict) for section in sections):
+        raise ValueError(f"Error: Sections config '{config_path}' must contain a JSON list of section objects.")
+    return sections
+
+def run_portfolio_analysis(folder_name: str, sections_to_analyze: list = None, output_format: str = "html",
+                           graph_options: dict = None, embeddings_model: str = None):
     """
     Orchestrates the portfolio analysis process.
 
@@ -167,15 +229,22 @@ def run_portfolio_analysis(folder_name: str, sections_to_analyze: list = None):
         sections_to_analyze (list, optional): A list of dictionaries defining the sections
                                                to analyze. If None, a default set of sections
                                                will be used.
+        output_format (str): "json" to write only the JSONL report, or "html" to also render the HTML report.
+        graph_options (dict, optional): Keyword arguments for PortfolioAnalysisGraph, overriding the defaults.
+        embeddings_model (str, optional): An embeddings model name. When set, each section is sent only
+                                          the document chunks retrieved for it instead of every document.
     """
     try:
-        # 1. Initialize environment and LLM
-        llm = _initialize_environment()
-
-        # 2. Prepare data folder (validate existence and convert Excel files)
+        # 1. Prepare data folder (validate existence and convert Excel files) before the LLM client
+        # is imported and initialized, so a bad folder argument fails immediately
         data_folder = folder_name
         _prepare_data_folder(data_folder)
 
+        # 2. Initialize environment and LLM
+        llm = _initialize_environment()
+        if embeddings_model:
+            graph_options = {**(graph_options or {}), "embeddings": _initialize_embeddings(embeddings_model)}
+
         # 3. Load and display documents
         loaded_docs = _load_and_display_documents(data_folder)
 
@@ -184,13 +253,14 @@ def run_portfolio_analysis(folder_name: str, sections_to_analyze: list = None):
 
         # 5. Set up output directory
         output_dir = "outputs"
-        os.makedirs(output_dir, exist_ok=True)
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
 
-        # 6. Execute analysis and save JSON report
-        json_report_path = _execute_analysis_and_save_report(llm, loaded_docs, sections_to_analyze, output_dir)
+        # 6. Execute analysis and save JSONL report
+        json_report_path, section_reports = _execute_analysis_and_save_report(llm, loaded_docs, sections_to_analyze, output_dir, graph_options)
 
         # 7. Generate HTML report
-        _generate_html_report(json_report_path, output_dir)
+        if output_format == "html":
+            _generate_html_report(json_report_path, output_dir, section_reports)
 
     except (ValueError, FileNotFoundError) as e:
         print(f"An error occurred: {e}")
@@ -200,16 +270,68 @@ def run_portfolio_analysis(folder_name: str, sections_to_analyze: list = None):
 def main():
     """
     Main function to run the portfolio analysis agent.
-    It now accepts a folder name as a command-line argument to specify
-    which data folder to load documents from.
+    Accepts the data folder to analyze, the output format, an optional JSON file of
+    section definitions, and the PortfolioAnalysisGraph options as command-line arguments.
     """
-    if len(sys.argv) < 2:
-        print("Usage: poetry run python run_agent.py <path_to_data_folder>")
-        print("Please provide the full path to the data folder to analyze.")
-        return
-    
-    folder_name = sys.argv[1]
-    run_portfolio_analysis(folder_name)
+    parser = argparse.ArgumentParser(description="Run the portfolio analysis agent over a folder of documents.")
+    parser.add_argument("folder", type=str, help="Full path to the data folder to analyze.")
+    parser.add_argument("--output-format", choices=["json", "html"], default="html",
+                        help="Write only the JSONL report, or also render the HTML report (default: html).")
+    parser.add_argument("--sections-config", type=str, default=None,
+                        help="Path to a JSON file with the sections to analyze. Defaults to DEFAULT_SECTIONS_TO_ANALYZE.")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Log per-node progress and debug output from the agent.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Make every LLM call again instead of reusing responses cached on disk by earlier runs.")
+    parser.add_argument("--max-review-loops", type=int, default=1,
+                        help="How many times each section is reviewed and rewritten (default: 1).")
+    parser.add_argument("--no-key-highlights", action="store_true",
+                        help="With --max-review-loops 0, skip the review that only produces the key highlights (one LLM call per section).")
+    parser.add_argument("--fuse-section-calls", action="store_true",
+                        help="Draft each section with its table and graphs in one LLM call.")
+    parser.add_argument("--extraction-batch-size", type=int, default=1,
+                        help="Extract this many sections per LLM call (default: 1, no batching).")
+    parser.add_argument("--embeddings-model", type=str, default=None,
+                        help="Embeddings model (e.g. models/text-embedding-004) used to send each section only its most relevant document chunks.")
+    parser.add_argument("--retrieval-top-k", type=int, default=8,
+                        help="Document chunks retrieved per section with --embeddings-model (default: 8).")
+    parser.add_argument("--documents-per-section", type=int, default=None,
+                        help="Without --embeddings-model, send each section only its N most relevant documents by keyword ranking.")
+    parser.add_argument("--context-cache", action="store_true",
+                        help="Upload the documents to Gemini once per run as cached content instead of sending them with every prompt.")
+    args = parser.parse_args()
+
+    # Node-level progress is logged (not printed) so its formatting is skipped unless enabled.
+    # Records are handed to a queue and written to stderr by a listener thread, so concurrent
+    # sections never block on the stream while they log.
+    log_queue = queue.SimpleQueue()
+    stderr_handler = logging.StreamHandler()
+    stderr_handler.setFormatter(logging.Formatter("%(message)s"))
+    log_listener = logging.handlers.QueueListener(log_queue, stderr_handler)
+    log_listener.start()
+    atexit.register(log_listener.stop) # Flushes the queued records on exit
+    logging.basicConfig(handlers=[logging.handlers.QueueHandler(log_queue)])
+    logging.getLogger("src").setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+    sections_to_analyze = None
+    if args.sections_config:
+        try:
+            sections_to_analyze = _load_sections_config(args.sections_config)
+        except (ValueError, FileNotFoundError) as e:
+            print(f"An error occurred: {e}")
+            return
+
+    graph_options = {
+        "max_review_loops": args.max_review_loops,
+        "generate_key_highlights": not args.no_key_highlights,
+        "fuse_section_calls": args.fuse_section_calls,
+        "extraction_batch_size": args.extraction_batch_size,
+        "retrieval_top_k": args.retrieval_top_k,
+        "documents_per_section": args.documents_per_section,
+        "use_context_cache": args.context_cache,
+        "reuse_cached_responses": not args.no_cache,
+    }
+    run_portfolio_analysis(args.folder, sections_to_analyze, args.output_format, graph_options, args.embeddings_model)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,18 +1,92 @@
 import os
-from typing import List, Dict, Any
+import re
+import bisect
+import hashlib
+import itertools
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import PyPDF2 # For PDF processing
 import logging
+from ..utils.llm_cache import DocumentCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def load_documents_from_folder(folder_path: str) -> List[Dict[str, Any]]:
+def _load_document(folder_path: str, filename: str) -> Optional[Dict[str, Any]]:
+    """
+    Loads a single document from the folder.
+
+    Args:
+        folder_path (str): The path to the folder containing the document.
+        filename (str): The name of the file to load.
+
+    Returns:
+        Optional[Dict[str, Any]]: The loaded document with its content and metadata,
+                                  or None if the entry is not a file or is of an unsupported type.
+    """
+    file_path = os.path.join(folder_path, filename)
+    if not os.path.isfile(file_path):
+        return None
+
+    file_extension = os.path.splitext(filename)[1].lower()
+    content = None
+    doc_type = "unknown"
+
+    try:
+        if file_extension == ".txt":
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            doc_type = "text"
+            logging.info(f"Successfully loaded text file: {filename}")
+        elif file_extension == ".csv":
+            df = pd.read_csv(file_path)
+            content = df.to_string() # Convert DataFrame to string for content
+            doc_type = "csv"
+            logging.info(f"Successfully loaded CSV file: {filename}")
+        elif file_extension == ".pdf":
+            # Using PyPDF2 for PDF text extraction
+            with open(file_path, 'rb') as f:
+                reader = PyPDF2.PdfReader(f)
+                text_content = ""
+                for page_num in range(len(reader.pages)):
+                    text_content += reader.pages[page_num].extract_text() or ""
+                content = text_content
+            doc_type = "pdf"
+            logging.info(f"Successfully loaded PDF file: {filename}")
+        else:
+            logging.warning(f"Unsupported file type, skipping: {filename}")
+            return None # Skip unsupported file types
+
+        return {
+            "filename": filename,
+            "content": content,
+            "token_count": estimate_tokens(content or ""), # Approximate size for reporting; prompt budgets use exact character counts
+            "metadata": {"source": file_path, "type": doc_type}
+        }
+    except Exception as e:
+        logging.error(f"Error processing {filename}: {e}")
+        return {
+            "filename": filename,
+            "content": None,
+            "token_count": 0,
+            "metadata": {"source": file_path, "type": doc_type, "error": str(e)}
+        }
+
+def load_documents_from_folder(folder_path: str, max_workers: Optional[int] = None,
+                               cache: Optional[DocumentCache] = None) -> List[Dict[str, Any]]:
     """
     Loads documents from a specified folder, supporting various formats (TXT, CSV, PDF).
+    Files are parsed concurrently on a thread pool; the returned list keeps the
+    directory listing order so prompts and cache keys stay stable between runs.
 
     Args:
         folder_path (str): The path to the folder containing the documents.
+        max_workers (Optional[int]): The maximum number of files parsed at the same time.
+                                     Defaults to the ThreadPoolExecutor default.
+        cache (Optional[DocumentCache]): If provided, files unchanged since an earlier run are
+                                         taken from the cache instead of being parsed again.
 
     Returns:
         List[Dict[str, Any]]: A list of dictionaries, where each dictionary represents
@@ -22,65 +96,156 @@ def load_documents_from_folder(folder_path: str) -> List[Dict[str, Any]]:
         logging.error(f"Folder not found: {folder_path}")
         raise FileNotFoundError(f"Folder not found: {folder_path}")
 
-    documents = []
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        if os.path.isfile(file_path):
-            file_extension = os.path.splitext(filename)[1].lower()
-            content = None
-            doc_type = "unknown"
-
-            try:
-                if file_extension == ".txt":
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    doc_type = "text"
-                    logging.info(f"Successfully loaded text file: {filename}")
-                elif file_extension == ".csv":
-                    df = pd.read_csv(file_path)
-                    content = df.to_string() # Convert DataFrame to string for content
-                    doc_type = "csv"
-                    logging.info(f"Successfully loaded CSV file: {filename}")
-                elif file_extension == ".pdf":
-                    # Using PyPDF2 for PDF text extraction
-                    with open(file_path, 'rb') as f:
-                        reader = PyPDF2.PdfReader(f)
-                        text_content = ""
-                        for page_num in range(len(reader.pages)):
-                            text_content += reader.pages[page_num].extract_text() or ""
-                        content = text_content
-                    doc_type = "pdf"
-                    logging.info(f"Successfully loaded PDF file: {filename}")
-                else:
-                    logging.warning(f"Unsupported file type, skipping: {filename}")
-                    continue # Skip unsupported file types
-
-                documents.append({
-                    "filename": filename,
-                    "content": content,
-                    "metadata": {"source": file_path, "type": doc_type}
-                })
-            except Exception as e:
-                logging.error(f"Error processing {filename}: {e}")
-                documents.append({
-                    "filename": filename,
-                    "content": None,
-                    "metadata": {"source": file_path, "type": doc_type, "error": str(e)}
-                })
-    return documents
+    filenames = os.listdir(folder_path)
+    file_keys = {}
+    cached = {}
+    if cache is not None:
+        file_keys = {
+            filename: DocumentCache.file_key(os.path.join(folder_path, filename))
+            for filename in filenames if os.path.isfile(os.path.join(folder_path, filename))
+        }
+        cached = cache.get_many(list(file_keys.values()))
+        logging.info(f"{len(cached)} of {len(file_keys)} files unchanged since they were cached.")
+
+    to_parse = [filename for filename in filenames if file_keys.get(filename) not in cached]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        parsed = dict(zip(to_parse, executor.map(lambda filename: _load_document(folder_path, filename), to_parse)))
+
+    if cache is not None:
+        # Files that failed to parse are not cached, so they are retried next run
+        cache.put_many({
+            file_keys[filename]: doc for filename, doc in parsed.items()
+            if doc is not None and doc["content"] is not None and filename in file_keys
+        })
+
+    loaded = (cached[file_keys[filename]] if filename not in parsed else parsed[filename] for filename in filenames)
+    return [doc for doc in loaded if doc is not None]
+
+# Paragraphs shorter than this (headings, page numbers, table rows) are always kept, even when repeated
+MIN_DEDUPLICATED_PARAGRAPH_CHARS = 200
+_PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+
+def _content_hash(text: str, digest_size: int = 16) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=digest_size).digest()
+
+def deduplicate_documents(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Removes content that is repeated across the corpus, so it is only sent to the LLM once.
+    Documents identical to an earlier one are dropped, and paragraphs that already appeared
+    in an earlier document (e.g. standard disclaimers) are removed from later ones.
+
+    Args:
+        documents (List[Dict[str, Any]]): The loaded documents.
+
+    Returns:
+        List[Dict[str, Any]]: The documents in their original order, without the repeated content.
+                              A document with paragraphs removed records how many in its
+                              metadata as 'deduplicated_paragraphs'.
+    """
+    seen_documents = {}
+    seen_paragraphs = set()
+    deduplicated = []
+    for doc in documents:
+        content = doc.get("content")
+        if not content:
+            deduplicated.append(doc)
+            continue
+
+        document_hash = _content_hash(content)
+        if document_hash in seen_documents:
+            logging.info(f"Skipping {doc.get('filename', 'N/A')}: same content as {seen_documents[document_hash]}")
+            continue
+        seen_documents[document_hash] = doc.get("filename", "N/A")
+
+        kept_paragraphs = []
+        removed_count = 0
+        for paragraph in _PARAGRAPH_BREAK_RE.split(content):
+            if len(paragraph) >= MIN_DEDUPLICATED_PARAGRAPH_CHARS:
+                paragraph_hash = _content_hash(paragraph.strip(), digest_size=8)
+                if paragraph_hash in seen_paragraphs:
+                    removed_count += 1
+                    continue
+                seen_paragraphs.add(paragraph_hash)
+            kept_paragraphs.append(paragraph)
+
+        if removed_count:
+            logging.info(f"Removed {removed_count} repeated paragraphs from {doc.get('filename', 'N/A')}")
+            content = "\n\n".join(kept_paragraphs)
+            doc = {
+                **doc,
+                "content": content,
+                "token_count": estimate_tokens(content),
+                "metadata": {**doc.get("metadata", {}), "deduplicated_paragraphs": removed_count}
+            }
+        deduplicated.append(doc)
+    return deduplicated
+
+# Rough characters-per-token ratio used to estimate prompt size without a tokenizer round-trip
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of LLM tokens in a piece of text.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The approximate token count.
+    """
+    return len(text) // CHARS_PER_TOKEN
+
+def format_documents_for_prompt(documents: List[Dict[str, Any]], max_tokens: Optional[int] = None) -> str:
+    """
+    Formats loaded documents into a single string for inclusion in an LLM prompt.
+    The documents are invariant across a run, so this is meant to be computed once
+    and shared by every section.
+
+    Args:
+        documents (List[Dict[str, Any]]): The loaded documents.
+        max_tokens (Optional[int]): An approximate token budget for the formatted documents.
+                                    Content past the budget is truncated (with a warning) and
+                                    later documents are dropped. None disables truncation.
+
+    Returns:
+        str: The documents, each preceded by a '--- Document: <filename> ---' header.
+    """
+    headers = [f"--- Document: {doc.get('filename', 'N/A')} ---\n" for doc in documents]
+    contents = [doc.get("content") or "Content not available" for doc in documents]
+    if max_tokens is None:
+        return "\n".join(header + content for header, content in zip(headers, contents))
+
+    # The last document that fits is found by binary search over the cumulative sizes, without formatting
+    # the documents that will not fit. Sizes are exact character counts (len() is O(1)); the rounded-down
+    # token_count would let documents past the budget through.
+    budget_chars = max_tokens * CHARS_PER_TOKEN
+    cumulative_chars = list(itertools.accumulate(
+        len(header) + len(content) + 1 # +1 for the joining newline
+        for header, content in zip(headers, contents)
+    ))
+    cutoff = bisect.bisect_right(cumulative_chars, budget_chars + 1) # The last entry has no joining newline
+    formatted = [headers[i] + contents[i] for i in range(cutoff)]
+
+    remaining_chars = budget_chars - (cumulative_chars[cutoff - 1] if cutoff else 0)
+    for i in range(cutoff, len(documents)):
+        filename = documents[i].get("filename", "N/A")
+        if i == cutoff and remaining_chars > 0:
+            logging.warning(f"Token budget of {max_tokens} reached. Truncating document in prompt: {filename}")
+            formatted.append((headers[i] + contents[i])[:remaining_chars])
+        else:
+            logging.warning(f"Token budget of {max_tokens} reached. Dropping document from prompt: {filename}")
+    return "\n".join(formatted)
 
 if __name__ == "__main__":
     # Example usage:
     # Create a dummy data folder and some files for testing
-    dummy_data_folder = "temp_data_for_testing"
-    os.makedirs(dummy_data_folder, exist_ok=True)
-    with open(os.path.join(dummy_data_folder, "doc1.txt"), "w") as f:
-        f.write("This is the content of document 1.")
-    with open(os.path.join(dummy_data_folder, "doc2.csv"), "w") as f:
-        f.write("header1,header2\nvalue1,value2")
+    dummy_data_folder = Path("temp_data_for_testing")
+    dummy_data_folder.mkdir(parents=True, exist_ok=True)
+    (dummy_data_folder / "doc1.txt").write_text("This is the content of document 1.")
+    (dummy_data_folder / "doc2.csv").write_text("header1,header2\nvalue1,value2")
 
     print(f"Loading documents from: {dummy_data_folder}")
-    loaded_docs = load_documents_from_folder(dummy_data_folder)
+    loaded_docs = load_documents_from_folder(str(dummy_data_folder))
     for doc in loaded_docs:
         print(f"--- Document: {doc['filename']} ---")
         print(f"Content: {doc['content'][:50]}...") # Print first 50 chars
@@ -88,6 +253,6 @@ if __name__ == "__main__":
         print("-" * 30)
 
     # Clean up dummy data
-    os.remove(os.path.join(dummy_data_folder, "doc1.txt"))
-    os.remove(os.path.join(dummy_data_folder, "doc2.csv"))
-    os.rmdir(dummy_data_folder)
\ No newline at end of file
+    (dummy_data_folder / "doc1.txt").unlink()
+    (dummy_data_folder / "doc2.csv").unlink()
+    dummy_data_folder.rmdir()
\ No newline at end of file
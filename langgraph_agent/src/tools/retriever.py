@@ -0,0 +1,172 @@
+import logging
+import math
+import re
+from collections import Counter
+from typing import List, Dict, Any, Optional
+import numpy as np
+from ..utils.llm_cache import EmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+class DocumentRetriever:
+    """
+    Retrieves the document passages most relevant to a section, so prompts carry
+    the top-K chunks instead of the full text of every document.
+
+    Documents are split into fixed-size, overlapping chunks and embedded once per run with a single
+    batched `embed_documents` call (cached on disk by chunk hash). Retrieval is an exact
+    inner-product search over the normalized chunk embeddings.
+    """
+    def __init__(self, embeddings, chunk_size: int = 2048, top_k: int = 8, cache: Optional[EmbeddingCache] = None,
+                 chunk_overlap: int = 256):
+        """
+        Initializes the DocumentRetriever.
+
+        Args:
+            embeddings: A LangChain-compatible embeddings model (`embed_documents` / `embed_query`).
+            chunk_size (int): The chunk size in characters (~512 tokens at the default).
+            top_k (int): The number of chunks returned per query.
+            cache (Optional[EmbeddingCache]): Cache of chunk embeddings. A default on-disk cache is used if not provided.
+            chunk_overlap (int): Characters shared by consecutive chunks, so a passage split at a chunk
+                                 boundary is still retrievable as a whole.
+        """
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError("chunk_overlap must be at least 0 and smaller than chunk_size.")
+        self.embeddings = embeddings
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.top_k = top_k
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.chunks: List[Dict[str, Any]] = []
+        self.matrix: Optional[np.ndarray] = None
+
+    def _chunk_documents(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        chunks = []
+        step = self.chunk_size - self.chunk_overlap
+        for doc in documents:
+            content = doc.get("content") or ""
+            if not content:
+                continue
+            # The last window starts where the remaining text fits in one chunk, so no chunk is pure overlap
+            for chunk_index, start in enumerate(range(0, max(len(content) - self.chunk_overlap, 1), step)):
+                chunks.append({
+                    "filename": doc.get("filename", "N/A"),
+                    "chunk_index": chunk_index,
+                    "text": content[start:start + self.chunk_size]
+                })
+        return chunks
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def index(self, documents: List[Dict[str, Any]]) -> None:
+        """
+        Chunks and embeds the documents. Only chunks missing from the cache are sent
+        to the embeddings API, in one batched call.
+
+        Args:
+            documents (List[Dict[str, Any]]): The loaded documents.
+        """
+        self.chunks = self._chunk_documents(documents)
+        texts = [chunk["text"] for chunk in self.chunks]
+        if not texts:
+            self.matrix = None
+            return
+
+        cached = self.cache.get_many(texts)
+        missing = list(dict.fromkeys(text for text in texts if text not in cached))
+        if missing:
+            logger.info("Embedding %s of %s document chunks (%s cached).", len(missing), len(texts), len(texts) - len(missing))
+            new_embeddings = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            self.cache.put_many(new_embeddings)
+            cached.update(new_embeddings)
+
+        self.matrix = self._normalize(np.array([cached[text] for text in texts], dtype=np.float32))
+
+    def retrieve(self, query: str) -> List[Dict[str, Any]]:
+        """
+        Returns the `top_k` chunks most similar to the query, in document order.
+
+        Args:
+            query (str): The text to search for, e.g. the section title and instruction.
+
+        Returns:
+            List[Dict[str, Any]]: The matching chunks, each with 'filename', 'chunk_index' and 'text'.
+        """
+        if self.matrix is None:
+            return []
+        query_vector = self._normalize(np.array(self.embeddings.embed_query(query), dtype=np.float32))
+        scores = self.matrix @ query_vector
+        top_indices = np.argsort(-scores)[:self.top_k]
+        return [self.chunks[i] for i in sorted(top_indices)]
+
+    def format_relevant_documents(self, query: str) -> str:
+        """
+        Formats the chunks relevant to the query for inclusion in an LLM prompt.
+
+        Args:
+            query (str): The text to search for.
+
+        Returns:
+            str: The retrieved chunks, each preceded by a '--- Document: <filename> (chunk <n>) ---' header.
+        """
+        return "\n".join(
+            f"--- Document: {chunk['filename']} (chunk {chunk['chunk_index']}) ---\n"
+            f"{chunk['text']}"
+            for chunk in self.retrieve(query)
+        )
+
+
+_TOKEN_RE = re.compile(r"\w+")
+
+class KeywordDocumentRanker:
+    """
+    Ranks whole documents against a query with BM25, as a cheap filter when no embeddings
+    model is configured. Term statistics are computed once per run; scoring a query only
+    touches the query's terms.
+    """
+    def __init__(self, documents: List[Dict[str, Any]], k1: float = 1.5, b: float = 0.75):
+        """
+        Initializes the KeywordDocumentRanker.
+
+        Args:
+            documents (List[Dict[str, Any]]): The loaded documents.
+            k1 (float): BM25 term-frequency saturation.
+            b (float): BM25 document-length normalization.
+        """
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(_TOKEN_RE.findall((doc.get("content") or "").lower())) for doc in documents]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        total = len(documents)
+        self.idf = {term: math.log(1 + (total - freq + 0.5) / (freq + 0.5)) for term, freq in document_frequency.items()}
+
+    def top_documents(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+        """
+        Returns the `top_k` documents scoring highest for the query, in their original order.
+
+        Args:
+            query (str): The text to rank against, e.g. the section title and instruction.
+            top_k (int): The number of documents to keep.
+
+        Returns:
+            List[Dict[str, Any]]: The selected documents. All documents are returned if the query
+                                  matches none of them, so a section is never left without context.
+        """
+        query_terms = [term for term in set(_TOKEN_RE.findall(query.lower())) if term in self.idf]
+        if not query_terms or top_k >= len(self.documents):
+            return self.documents
+        scores = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            length_norm = self.k1 * (1 - self.b + self.b * length / (self.average_length or 1))
+            scores.append(sum(
+                self.idf[term] * counts[term] * (self.k1 + 1) / (counts[term] + length_norm)
+                for term in query_terms if term in counts
+            ))
+        top_indices = sorted(range(len(scores)), key=lambda i: -scores[i])[:top_k]
+        return [self.documents[i] for i in sorted(top_indices)]
@@ -0,0 +1,91 @@
+import datetime
+import hashlib
+import logging
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+class DocumentContextCache:
+    """
+    Uploads the documents shared by every section's prompts to Gemini once per run as
+    explicit cached content, so each request references the cache instead of resending
+    (and re-prefilling) the documents.
+
+    Requests that use cached content cannot carry their own system instruction, so the
+    cached model sends system messages as part of the first human message instead. That
+    only happens when a prompt has a single system message ahead of its first human
+    message, so node prompts keep all of their system text in one message.
+    """
+    def __init__(self, llm, ttl: datetime.timedelta = datetime.timedelta(hours=1)):
+        """
+        Initializes the DocumentContextCache.
+
+        Args:
+            llm: A ChatGoogleGenerativeAI instance. The cache is created for its model.
+            ttl (datetime.timedelta): How long Gemini keeps the cache if it is not deleted.
+        """
+        self.llm = llm
+        self.ttl = ttl
+        self.name: Optional[str] = None
+        self._client = None
+
+    def _build_client(self):
+        from google.ai.generativelanguage_v1beta import CacheServiceAsyncClient
+        credentials = getattr(self.llm, "credentials", None)
+        if credentials is not None:
+            return CacheServiceAsyncClient(credentials=credentials, transport="grpc_asyncio")
+        api_key = self.llm.google_api_key.get_secret_value()
+        return CacheServiceAsyncClient(client_options={"api_key": api_key}, transport="grpc_asyncio")
+
+    async def acreate(self, formatted_documents: str) -> Optional[Any]:
+        """
+        Caches the formatted documents and returns a copy of the LLM that uses the cache.
+
+        Args:
+            formatted_documents (str): The documents as formatted for prompts.
+
+        Returns:
+            Optional[Any]: The cached LLM, or None if the cache could not be created (e.g. the documents
+                           are below the model's minimum cacheable size); callers then send the documents inline.
+        """
+        from google.ai.generativelanguage_v1beta import CachedContent, Content, Part
+        try:
+            self._client = self._build_client()
+            cached_content = await self._client.create_cached_content(cached_content=CachedContent(
+                model=self.llm.model,
+                display_name="portfolio-analysis-documents",
+                contents=[Content(role="user", parts=[Part(text=f"All Documents:\n{formatted_documents}")])],
+                ttl=self.ttl,
+            ))
+        except Exception as e:
+            logger.warning("Context cache could not be created; sending documents inline: %s", e)
+            return None
+        self.name = cached_content.name
+        logger.info("Cached the documents as '%s' (%s tokens).", self.name, cached_content.usage_metadata.total_token_count)
+        return self.llm.model_copy(update={"cached_content": self.name, "convert_system_message_to_human": True})
+
+    async def adelete(self) -> None:
+        """
+        Deletes the cache, if one was created, rather than paying for storage until its TTL expires.
+        """
+        if self.name is None:
+            return
+        try:
+            await self._client.delete_cached_content(name=self.name)
+        except Exception as e:
+            logger.warning("Context cache '%s' could not be deleted: %s", self.name, e)
+        self.name = None
+
+def cached_documents_placeholder(formatted_documents: str) -> str:
+    """
+    Returns the text that stands in for the documents in prompts when they are in the context cache.
+    It carries a digest of the documents, so response cache keys still change with the documents.
+
+    Args:
+        formatted_documents (str): The documents as formatted for prompts.
+
+    Returns:
+        str: The placeholder text.
+    """
+    digest = hashlib.blake2b(formatted_documents.encode("utf-8"), digest_size=16).hexdigest()
+    return f"(The documents are provided in the cached context above. Documents digest: {digest})"
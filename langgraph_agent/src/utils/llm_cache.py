@@ -0,0 +1,340 @@
+import hashlib
+import json
+import os
+import orjson
+import sqlite3
+import numpy as np
+from typing import List, Dict, Any, Optional
+
+# Part of every ExtractionCache key. Bump it whenever the ExtractorNode prompts or response
+# schema change, so drafts produced by the old prompts are no longer served.
+EXTRACTOR_PROMPT_VERSION = 1
+
+def model_id(llm: Any) -> str:
+    """
+    Returns the identifier of the model behind a LangChain-compatible language model, for cache keys.
+    """
+    return getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__
+
+def documents_digest(documents: List[Dict[str, Any]]) -> str:
+    """
+    Computes a stable digest of the documents' filenames and content.
+
+    Args:
+        documents (List[Dict[str, Any]]): The loaded documents.
+
+    Returns:
+        str: A hex sha256 digest identifying this exact document set.
+    """
+    digest = hashlib.sha256()
+    for doc in documents:
+        digest.update(str(doc.get("filename", "")).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(str(doc.get("content", "")).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class ExtractionCache:
+    """
+    A SQLite-backed cache of ExtractorNode LLM responses, stored as JSON text.
+
+    Entries are keyed on sha256(model + prompt version + section_title + section_instruction +
+    documents digest), and only an exact match is a hit: a changed instruction, document set,
+    model or prompt always gets a fresh extraction.
+    """
+    def __init__(self, database_path: str = ".extractor_cache.db"):
+        """
+        Initializes the cache and creates the backing table if needed.
+
+        Args:
+            database_path (str): Path to the SQLite database file.
+        """
+        self.database_path = database_path
+        with sqlite3.connect(self.database_path) as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS extractor_cache (
+                    key TEXT PRIMARY KEY,
+                    section_title TEXT NOT NULL,
+                    section_instruction TEXT NOT NULL,
+                    documents_digest TEXT NOT NULL,
+                    response TEXT NOT NULL
+                )"""
+            )
+
+    @staticmethod
+    def _key(model: str, section_title: str, section_instruction: str, documents_digest: str) -> str:
+        return hashlib.sha256(
+            "\0".join([model, str(EXTRACTOR_PROMPT_VERSION), section_title, section_instruction, documents_digest]).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, model: str, section_title: str, section_instruction: str, documents_digest: str) -> Optional[str]:
+        """
+        Looks up the response cached for exactly this model, section, instruction and document set.
+
+        Returns:
+            Optional[str]: The cached response, or None on a miss.
+        """
+        with sqlite3.connect(self.database_path) as conn:
+            row = conn.execute(
+                "SELECT response FROM extractor_cache WHERE key = ?",
+                (self._key(model, section_title, section_instruction or "", documents_digest),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, model: str, section_title: str, section_instruction: str, documents_digest: str, response: str) -> None:
+        """
+        Stores a response for the given model, section, instruction, and document set.
+        """
+        section_instruction = section_instruction or ""
+        with sqlite3.connect(self.database_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO extractor_cache VALUES (?, ?, ?, ?, ?)",
+                (self._key(model, section_title, section_instruction, documents_digest),
+                 section_title, section_instruction, documents_digest, response)
+            )
+
+class EmbeddingCache:
+    """
+    A SQLite-backed cache of embedding vectors keyed by sha256 of the embedded text,
+    so repeat runs over the same documents skip the embedding API entirely.
+    """
+    def __init__(self, database_path: str = ".embedding_cache.db"):
+        """
+        Initializes the cache and creates the backing table if needed.
+
+        Args:
+            database_path (str): Path to the SQLite database file.
+        """
+        self.database_path = database_path
+        with sqlite3.connect(self.database_path) as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS embedding_cache (
+                    key TEXT PRIMARY KEY,
+                    embedding TEXT NOT NULL
+                )"""
+            )
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> Dict[str, List[float]]:
+        """
+        Looks up cached embeddings for the given texts.
+
+        Returns:
+            Dict[str, List[float]]: Cached embeddings keyed by text. Texts without an entry are omitted.
+        """
+        keys = {self._key(text): text for text in texts}
+        key_list = list(keys)
+        found = {}
+        with sqlite3.connect(self.database_path) as conn:
+            # Query in slices to stay under SQLite's bound-parameter limit
+            for start in range(0, len(key_list), 500):
+                key_slice = key_list[start:start + 500]
+                for key, embedding in conn.execute(
+                    f"SELECT key, embedding FROM embedding_cache WHERE key IN ({','.join('?' * len(key_slice))})",
+                    key_slice
+                ):
+                    found[keys[key]] = orjson.loads(embedding)
+        return found
+
+    def put_many(self, embeddings: Dict[str, List[float]]) -> None:
+        """
+        Stores embeddings keyed by the text they were computed from.
+        """
+        with sqlite3.connect(self.database_path) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache VALUES (?, ?)",
+                [(self._key(text), orjson.dumps(embedding).decode()) for text, embedding in embeddings.items()]
+            )
+
+def request_hash(prompt_text: str, llm: Any) -> str:
+    """
+    Computes a cache key for a fully formatted prompt sent to a specific model configuration.
+
+    Args:
+        prompt_text (str): The fully formatted prompt.
+        llm: The LangChain-compatible language model the prompt is sent to.
+
+    Returns:
+        str: A hex sha256 digest of the prompt, model id and temperature.
+    """
+    request = {
+        "prompt": prompt_text,
+        "model": model_id(llm),
+        "temperature": getattr(llm, "temperature", None)
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    A SQLite-backed cache of parsed LLM responses keyed by `request_hash`, so a node
+    rerun on identical inputs with the same model skips both the LLM call and parsing.
+    """
+    def __init__(self, database_path: str = ".response_cache.db"):
+        """
+        Initializes the cache and creates the backing table if needed.
+
+        Args:
+            database_path (str): Path to the SQLite database file.
+        """
+        self.database_path = database_path
+        with sqlite3.connect(self.database_path) as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL
+                )"""
+            )
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Looks up a cached response.
+
+        Returns:
+            Optional[Any]: The cached parsed response, or None on a miss.
+        """
+        with sqlite3.connect(self.database_path) as conn:
+            row = conn.execute("SELECT response FROM response_cache WHERE key = ?", (key,)).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def put(self, key: str, response: Any) -> None:
+        """
+        Stores a parsed response.
+        """
+        with sqlite3.connect(self.database_path) as conn:
+            conn.execute("INSERT OR REPLACE INTO response_cache VALUES (?, ?)", (key, orjson.dumps(response).decode()))
+
+class SemanticResponseCache:
+    """
+    A SQLite-backed semantic cache of parsed LLM responses. Requests are embedded and
+    compared by cosine similarity against earlier requests for the same node, section
+    title and exact document set; a match at or above `similarity_threshold` returns the
+    earlier response. Scoping by the documents' digest keeps a response written from one
+    company's documents from ever being served for another's.
+    """
+    def __init__(self, embeddings, database_path: str = ".semantic_cache.db", similarity_threshold: float = 0.95):
+        """
+        Initializes the cache and creates the backing table if needed.
+
+        Args:
+            embeddings: A LangChain-compatible embeddings model (`embed_query`).
+            database_path (str): Path to the SQLite database file.
+            similarity_threshold (float): Minimum cosine similarity (0-1) for a hit.
+        """
+        self.embeddings = embeddings
+        self.database_path = database_path
+        self.similarity_threshold = similarity_threshold
+        with sqlite3.connect(self.database_path) as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(semantic_cache)")}
+            if columns and "documents_digest" not in columns:
+                # Entries written before the cache was scoped by document set could match any documents
+                conn.execute("DROP TABLE semantic_cache")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS semantic_cache (
+                    key TEXT PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    section_title TEXT NOT NULL,
+                    documents_digest TEXT NOT NULL,
+                    embedding TEXT NOT NULL,
+                    response TEXT NOT NULL
+                )"""
+            )
+
+    def embed(self, text: str) -> List[float]:
+        """
+        Embeds and L2-normalizes the text describing a request.
+        """
+        vector = np.array(self.embeddings.embed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def lookup(self, namespace: str, section_title: str, documents_digest: str, embedding: List[float]) -> Optional[Any]:
+        """
+        Finds the most similar earlier request for the same namespace, section title and document set.
+
+        Returns:
+            Optional[Any]: The cached parsed response, or None if nothing is similar enough.
+        """
+        with sqlite3.connect(self.database_path) as conn:
+            rows = conn.execute(
+                "SELECT embedding, response FROM semantic_cache WHERE namespace = ? AND section_title = ? AND documents_digest = ?",
+                (namespace, section_title, documents_digest)
+            ).fetchall()
+        if not rows:
+            return None
+        matrix = np.array([orjson.loads(row[0]) for row in rows], dtype=np.float32)
+        scores = matrix @ np.array(embedding, dtype=np.float32)
+        best = int(np.argmax(scores))
+        return orjson.loads(rows[best][1]) if scores[best] >= self.similarity_threshold else None
+
+    def put(self, namespace: str, section_title: str, documents_digest: str, embedding: List[float], response: Any) -> None:
+        """
+        Stores a parsed response with the document set and the embedding of the request that produced it.
+        """
+        key = hashlib.sha256(json.dumps([namespace, section_title, documents_digest, embedding]).encode("utf-8")).hexdigest()
+        with sqlite3.connect(self.database_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO semantic_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (key, namespace, section_title, documents_digest, orjson.dumps(embedding).decode(), orjson.dumps(response).decode())
+            )
+
+class DocumentCache:
+    """
+    A SQLite-backed cache of loaded documents keyed by file path, modification time and size,
+    so reruns over an unchanged data folder skip re-parsing (notably PDF text extraction).
+    An edited file gets a new key and is parsed again.
+    """
+    def __init__(self, database_path: str = ".document_cache.db"):
+        """
+        Initializes the cache and creates the backing table if needed.
+
+        Args:
+            database_path (str): Path to the SQLite database file.
+        """
+        self.database_path = database_path
+        with sqlite3.connect(self.database_path) as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS document_cache (
+                    key TEXT PRIMARY KEY,
+                    document TEXT NOT NULL
+                )"""
+            )
+
+    @staticmethod
+    def file_key(file_path: str) -> str:
+        """
+        Returns the cache key for a file in its current state on disk.
+        """
+        stat = os.stat(file_path)
+        return hashlib.sha256(f"{os.path.abspath(file_path)}\0{stat.st_mtime_ns}\0{stat.st_size}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Looks up cached documents.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Cached documents by key. Keys without an entry are omitted.
+        """
+        found = {}
+        with sqlite3.connect(self.database_path) as conn:
+            # Query in slices to stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                key_slice = keys[start:start + 500]
+                for key, document in conn.execute(
+                    f"SELECT key, document FROM document_cache WHERE key IN ({','.join('?' * len(key_slice))})",
+                    key_slice
+                ):
+                    found[key] = orjson.loads(document)
+        return found
+
+    def put_many(self, documents: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Stores loaded documents by key.
+        """
+        with sqlite3.connect(self.database_path) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO document_cache VALUES (?, ?)",
+                [(key, orjson.dumps(document).decode()) for key, document in documents.items()]
+            )
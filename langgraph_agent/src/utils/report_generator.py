@@ -1,44 +1,103 @@
-import json
+import functools
+import orjson
 import os
 from datetime import datetime
 from jinja2 import Environment, FileSystemLoader
+from markupsafe import escape
 import markdown
-from bs4 import BeautifulSoup
+from typing import Iterator, List, Dict, Any, Optional
 
-def generate_html_report(json_report_path: str, output_html_path: str, template_file: str = 'templates/report_template.html'):
+# One converter for all conversions: markdown.markdown() builds a new Markdown instance (and
+# its processors) per call. Reports are rendered on a single thread, so sharing it is safe.
+_MARKDOWN = markdown.Markdown()
+
+@functools.lru_cache(maxsize=4096)
+def markdown_to_html(md_text: str) -> str:
     """
-    Generates a well-formatted HTML report from a JSON analysis report,
-    including tabular data and charts.
+    Converts markdown to HTML. Cached, since short strings (sub-section titles, "N/A" cells)
+    repeat across a report.
+    """
+    return _MARKDOWN.reset().convert(md_text)
+
+def table_rows_html(rows: List[Dict[str, Any]]) -> str:
+    """
+    Renders a table's body rows as HTML in one pass, with each cell value HTML-escaped,
+    instead of walking every cell in the template.
+    """
+    return "\n".join(
+        "<tr>" + "".join(f"<td>{escape('' if value is None else value)}</td>" for value in row.values()) + "</tr>"
+        for row in rows
+    )
+
+# Created once per process: the environment caches compiled templates, so repeated
+# reports only render rather than re-parse and re-compile the template and its widgets.
+_ENV = Environment(loader=FileSystemLoader(os.path.dirname(__file__)))
+_ENV.filters['markdown_to_html'] = markdown_to_html
+_ENV.filters['table_rows_html'] = table_rows_html
+# Serialize chart data for the `tojson` filter with orjson; Jinja still applies its HTML-safe escaping
+_ENV.policies['json.dumps_function'] = lambda obj, **kwargs: orjson.dumps(obj).decode()
+_ENV.policies['json.dumps_kwargs'] = {}
+
+def iter_report(json_report_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yields report sections from a JSONL report (one section per line) one at a time or,
+    for older reports and samples, from a JSON array of sections.
 
     Args:
-        json_report_path (str): The file path to the input JSON report.
-        output_html_path (str): The full file path for the output HTML document.
+        json_report_path (str): The file path to the report.
+
+    Yields:
+        Dict[str, Any]: The next report section.
     """
-    try:
-        with open(json_report_path, 'r', encoding='utf-8') as f:
-            report_data = json.load(f)
+    with open(json_report_path, 'rb') as f:
+        if json_report_path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield orjson.loads(line)
+        else:
+            yield from orjson.loads(f.read())
 
-        # Set up Jinja2 environment
-        env = Environment(loader=FileSystemLoader(os.path.dirname(__file__)))
+def load_report(json_report_path: str) -> List[Dict[str, Any]]:
+    """
+    Loads all report sections (see `iter_report`).
+
+    Args:
+        json_report_path (str): The file path to the report.
 
-        # Add a filter to convert markdown to HTML
-        def markdown_to_html(md_text):
-            return markdown.markdown(md_text)
-        env.filters['markdown_to_html'] = markdown_to_html
+    Returns:
+        List[Dict[str, Any]]: The report sections.
+    """
+    return list(iter_report(json_report_path))
 
-        template = env.get_template(template_file)
+def generate_html_report(json_report_path: str, output_html_path: str, template_file: str = 'templates/report_template.html',
+                         report_data: Optional[List[Dict[str, Any]]] = None):
+    """
+    Generates a well-formatted HTML report from a JSONL (or JSON) analysis report,
+    including tabular data and charts.
+
+    Args:
+        json_report_path (str): The file path to the input JSONL or JSON report.
+        output_html_path (str): The full file path for the output HTML document.
+        report_data (Optional[List[Dict[str, Any]]]): The report sections, if already in memory.
+                                                      When provided, the JSON file is not read back;
+                                                      otherwise it is streamed section by section.
+    """
+    try:
+        if report_data is None:
+            # Sections are read one at a time while rendering, so the whole report is never held in memory
+            report_data = iter_report(json_report_path)
 
-        # Render the template
-        html_content = template.render(report_data=report_data, datetime=datetime)
+        template = _ENV.get_template(template_file)
 
+        # Render the template straight to the file, chunk by chunk, rather than building the whole page in memory
         os.makedirs(os.path.dirname(output_html_path), exist_ok=True)
         with open(output_html_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+            template.stream(report_data=report_data, datetime=datetime).dump(f)
         print(f"HTML report successfully generated at '{output_html_path}'")
 
     except FileNotFoundError:
         print(f"Error: JSON report file not found at '{json_report_path}'")
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         print(f"Error: Could not decode JSON from '{json_report_path}'. Ensure it's a valid JSON file.")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
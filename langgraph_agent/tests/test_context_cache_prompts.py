@@ -0,0 +1,54 @@
+import warnings
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+from langchain_google_genai.chat_models import _parse_chat_history
+
+from src.agents.extractor import ExtractorNode
+from src.agents.graph_generator import GraphGeneratorNode
+from src.agents.reviewer import ReviewerNode
+from src.agents.section_composer import SectionComposerNode
+from src.agents.table_generator import TableGeneratorNode
+from src.agents.writer import WriterNode
+from src.utils.llm_cache import ExtractionCache, ResponseCache
+
+
+def _format_messages(prompt):
+    return prompt.format_messages(**{name: "x" for name in prompt.input_variables})
+
+
+@pytest.fixture
+def nodes(tmp_path):
+    llm = FakeListChatModel(responses=[])
+    response_cache = ResponseCache(str(tmp_path / "response.db"))
+    extractor = ExtractorNode(llm, cache=ExtractionCache(str(tmp_path / "extractor.db")))
+    return {
+        "extractor": extractor,
+        "reviewer": ReviewerNode(llm, cache=response_cache),
+        "writer": WriterNode(llm, cache=response_cache),
+        "table": TableGeneratorNode(llm, cache=response_cache),
+        "graph": GraphGeneratorNode(llm, cache=response_cache),
+        "composer": SectionComposerNode(llm, extractor, cache=response_cache),
+    }
+
+
+def _prompt_messages(nodes):
+    yield "extractor", _format_messages(nodes["extractor"].prompt)
+    yield "extractor batch", _format_messages(nodes["extractor"].batch_prompt)
+    for name in ("reviewer", "writer", "table", "graph"):
+        yield name, _format_messages(nodes[name].prompt)
+    # The composer sends a plain string prompt, which the chat model receives as a single human message
+    composer_prompt = nodes["composer"].prompt
+    yield "composer", [HumanMessage(content=composer_prompt.format(**{name: "x" for name in composer_prompt.input_variables}))]
+
+
+def test_no_system_instruction_survives_with_cached_content(nodes):
+    # A request that uses Gemini cached content cannot carry a system instruction, so every
+    # prompt must fold its system text into the first human message.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for name, messages in _prompt_messages(nodes):
+            system_instruction, contents = _parse_chat_history(messages, convert_system_message_to_human=True)
+            assert system_instruction is None, name
+            assert contents[0].role == "user", name
@@ -0,0 +1,60 @@
+from src.tools.document_loader import CHARS_PER_TOKEN, deduplicate_documents, estimate_tokens, format_documents_for_prompt
+
+
+def _document(filename, content):
+    return {"filename": filename, "content": content, "token_count": estimate_tokens(content), "metadata": {}}
+
+
+def test_format_documents_without_a_budget_keeps_everything():
+    documents = [_document("a.txt", "alpha"), {"filename": "b.pdf", "content": None}]
+    assert format_documents_for_prompt(documents) == (
+        "--- Document: a.txt ---\nalpha\n--- Document: b.pdf ---\nContent not available"
+    )
+
+
+def test_format_documents_keeps_documents_that_fit_exactly():
+    documents = [_document("a.txt", "a" * 40), _document("b.txt", "b" * 40)]
+    full = format_documents_for_prompt(documents)
+    # The budget is in tokens; a budget covering the whole text keeps it unchanged
+    assert format_documents_for_prompt(documents, max_tokens=-(-len(full) // CHARS_PER_TOKEN)) == full
+
+
+def test_format_documents_truncates_the_straddling_document_and_drops_the_rest():
+    documents = [_document("a.txt", "a" * 40), _document("b.txt", "b" * 400), _document("c.txt", "c" * 40)]
+    formatted = format_documents_for_prompt(documents, max_tokens=30)
+
+    assert len(formatted) <= 30 * CHARS_PER_TOKEN
+    assert formatted.startswith("--- Document: a.txt ---\n" + "a" * 40 + "\n--- Document: b.txt ---\nbbb")
+    assert "c.txt" not in formatted
+
+
+def test_format_documents_budget_smaller_than_the_first_document():
+    formatted = format_documents_for_prompt([_document("a.txt", "a" * 400)], max_tokens=10)
+    assert formatted == ("--- Document: a.txt ---\n" + "a" * 400)[:10 * CHARS_PER_TOKEN]
+
+
+def test_deduplicate_drops_identical_documents():
+    documents = [_document("a.txt", "Same content."), _document("copy.txt", "Same content."), _document("b.txt", "Other.")]
+    assert [doc["filename"] for doc in deduplicate_documents(documents)] == ["a.txt", "b.txt"]
+
+
+def test_deduplicate_removes_only_long_repeated_paragraphs():
+    disclaimer = "This report is provided for information only. " * 5
+    first = _document("a.txt", f"Q1 results\n\n{disclaimer}\n\nRevenue grew 10%.")
+    second = _document("b.txt", f"Q1 results\n\n{disclaimer}\n\nRevenue grew 12%.")
+
+    deduplicated = deduplicate_documents([first, second])
+
+    assert deduplicated[0] is first
+    assert deduplicated[1]["content"] == "Q1 results\n\nRevenue grew 12%."
+    assert deduplicated[1]["token_count"] == estimate_tokens(deduplicated[1]["content"])
+    assert deduplicated[1]["metadata"]["deduplicated_paragraphs"] == 1
+
+
+def test_format_documents_stays_within_budget_when_sizes_are_not_multiples_of_the_token_ratio():
+    # Each document's token_count rounds its size down, so budgeting by token_count would admit all three
+    documents = [_document(name, "x" * 43) for name in ("a.txt", "b.txt", "c.txt")]
+    budget_chars = (len(format_documents_for_prompt(documents)) // CHARS_PER_TOKEN - 1) * CHARS_PER_TOKEN
+    formatted = format_documents_for_prompt(documents, max_tokens=budget_chars // CHARS_PER_TOKEN)
+
+    assert len(formatted) <= budget_chars
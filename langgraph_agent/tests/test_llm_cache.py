@@ -0,0 +1,53 @@
+from src.utils.llm_cache import ExtractionCache, SemanticResponseCache, documents_digest
+
+
+class FakeEmbeddings:
+    """Embeds text as fixed vectors, so tests choose exactly how similar two requests are."""
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+def test_extraction_cache_hits_only_exact_requests(tmp_path):
+    cache = ExtractionCache(str(tmp_path / "extractor.db"))
+    digest = documents_digest([{"filename": "a.txt", "content": "Revenue grew 10%."}])
+    cache.put("gemini-2.5-flash", "Overview", "Summarize the company.", digest, '{"sub_sections": []}')
+
+    assert cache.get("gemini-2.5-flash", "Overview", "Summarize the company.", digest) == '{"sub_sections": []}'
+    # A near-identical instruction is a different request
+    assert cache.get("gemini-2.5-flash", "Overview", "Summarize the company!", digest) is None
+    assert cache.get("gemini-2.5-pro", "Overview", "Summarize the company.", digest) is None
+    assert cache.get("gemini-2.5-flash", "Financials", "Summarize the company.", digest) is None
+    other_digest = documents_digest([{"filename": "a.txt", "content": "Revenue grew 12%."}])
+    assert cache.get("gemini-2.5-flash", "Overview", "Summarize the company.", other_digest) is None
+
+
+def test_extraction_cache_key_includes_prompt_version(tmp_path, monkeypatch):
+    cache = ExtractionCache(str(tmp_path / "extractor.db"))
+    cache.put("gemini-2.5-flash", "Overview", "", "digest", '{"sub_sections": []}')
+    monkeypatch.setattr("src.utils.llm_cache.EXTRACTOR_PROMPT_VERSION", 2)
+    assert cache.get("gemini-2.5-flash", "Overview", "", "digest") is None
+
+
+def test_semantic_cache_hits_similar_requests_for_the_same_documents(tmp_path):
+    embeddings = FakeEmbeddings({"request": [1.0, 0.0], "similar": [0.99, 0.05], "different": [0.0, 1.0]})
+    cache = SemanticResponseCache(embeddings, str(tmp_path / "semantic.db"), similarity_threshold=0.95)
+    digest = documents_digest([{"filename": "acme.pdf", "content": "Acme revenue grew 10%."}])
+    cache.put("table", "Overview", digest, cache.embed("request"), {"title": "Revenue"})
+
+    assert cache.lookup("table", "Overview", digest, cache.embed("similar")) == {"title": "Revenue"}
+    assert cache.lookup("table", "Overview", digest, cache.embed("different")) is None
+    assert cache.lookup("graph", "Overview", digest, cache.embed("request")) is None
+    assert cache.lookup("table", "Financials", digest, cache.embed("request")) is None
+
+
+def test_semantic_cache_never_crosses_document_sets(tmp_path):
+    embeddings = FakeEmbeddings({"request": [1.0, 0.0]})
+    cache = SemanticResponseCache(embeddings, str(tmp_path / "semantic.db"))
+    acme = documents_digest([{"filename": "report.pdf", "content": "Acme revenue grew 10%."}])
+    globex = documents_digest([{"filename": "report.pdf", "content": "Globex revenue fell 5%."}])
+    cache.put("writer", "Overview", acme, cache.embed("request"), {"sub_sections": []})
+
+    assert cache.lookup("writer", "Overview", globex, cache.embed("request")) is None
@@ -0,0 +1,15 @@
+from src.utils.report_generator import _ENV
+
+
+def test_table_title_headers_and_cells_are_escaped():
+    section = {"tabular_data": {
+        "title": "Revenue <script>alert(1)</script>",
+        "rows": [{"Growth <b>%</b>": "<i>10%</i>", "Quarter & Year": None}],
+    }}
+    html = _ENV.get_template("templates/widgets/_table.html").render(section=section)
+
+    assert "<script>" not in html and "<b>" not in html and "<i>" not in html
+    assert "Revenue &lt;script&gt;alert(1)&lt;/script&gt;" in html
+    assert "<th scope=\"col\">Growth &lt;b&gt;%&lt;/b&gt;</th>" in html
+    assert "<th scope=\"col\">Quarter &amp; Year</th>" in html
+    assert "<td>&lt;i&gt;10%&lt;/i&gt;</td><td></td>" in html
@@ -0,0 +1,73 @@
+from src.tools.retriever import DocumentRetriever, KeywordDocumentRanker
+from src.utils.llm_cache import EmbeddingCache
+
+
+class FakeEmbeddings:
+    """Embeds text by counting a few keywords, and records which texts it was asked to embed."""
+    KEYWORDS = ("revenue", "headcount", "risk")
+
+    def __init__(self):
+        self.embedded_documents = []
+
+    def _embed(self, text):
+        return [float(text.lower().count(keyword)) for keyword in self.KEYWORDS]
+
+    def embed_documents(self, texts):
+        self.embedded_documents.extend(texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def _retriever(tmp_path, embeddings=None, **kwargs):
+    return DocumentRetriever(embeddings or FakeEmbeddings(), cache=EmbeddingCache(str(tmp_path / "embedding.db")), **kwargs)
+
+
+def test_chunks_overlap_and_cover_the_whole_document(tmp_path):
+    retriever = _retriever(tmp_path, chunk_size=4, chunk_overlap=1)
+    chunks = retriever._chunk_documents([{"filename": "a.txt", "content": "0123456789"}, {"filename": "empty.txt", "content": ""}])
+
+    assert [chunk["text"] for chunk in chunks] == ["0123", "3456", "6789"]
+    assert [chunk["chunk_index"] for chunk in chunks] == [0, 1, 2]
+    assert all(chunk["filename"] == "a.txt" for chunk in chunks)
+
+
+def test_short_documents_are_a_single_chunk(tmp_path):
+    retriever = _retriever(tmp_path, chunk_size=4, chunk_overlap=1)
+    assert [chunk["text"] for chunk in retriever._chunk_documents([{"filename": "a.txt", "content": "abc"}])] == ["abc"]
+
+
+def test_retrieve_returns_the_most_similar_chunks_and_reuses_cached_embeddings(tmp_path):
+    documents = [
+        {"filename": "finance.txt", "content": "Revenue grew and revenue margins widened."},
+        {"filename": "people.txt", "content": "Headcount rose to 120."},
+        {"filename": "risks.txt", "content": "The main risk is customer concentration."},
+    ]
+    retriever = _retriever(tmp_path, top_k=1)
+    retriever.index(documents)
+    assert [chunk["filename"] for chunk in retriever.retrieve("revenue")] == ["finance.txt"]
+
+    embeddings = FakeEmbeddings()
+    _retriever(tmp_path, embeddings).index(documents)
+    assert embeddings.embedded_documents == []
+
+
+def test_keyword_ranker_keeps_the_best_matches_in_document_order():
+    documents = [
+        {"filename": "a.txt", "content": "Headcount and hiring plans."},
+        {"filename": "b.txt", "content": "Revenue, revenue growth and gross margin."},
+        {"filename": "c.txt", "content": "Office locations."},
+        {"filename": "d.txt", "content": "Gross margin by segment."},
+    ]
+    ranker = KeywordDocumentRanker(documents)
+
+    assert [doc["filename"] for doc in ranker.top_documents("revenue and gross margin", top_k=2)] == ["b.txt", "d.txt"]
+
+
+def test_keyword_ranker_keeps_every_document_without_a_usable_query():
+    documents = [{"filename": "a.txt", "content": "Revenue."}, {"filename": "b.txt", "content": "Margin."}]
+    ranker = KeywordDocumentRanker(documents)
+
+    assert ranker.top_documents("unrelated words", top_k=1) == documents
+    assert ranker.top_documents("revenue", top_k=2) == documents
@@ -0,0 +1,22 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from src.agents.reviewer import ReviewerNode
+from src.utils.llm_cache import ResponseCache
+
+
+def test_review_is_served_from_the_response_cache(tmp_path):
+    llm = FakeListChatModel(responses=[
+        '{"key_highlights": ["Revenue grew 10%"], "expand_on": [], "remove_or_rephrase": [], "search_terms": []}',
+        '{"key_highlights": ["A second LLM call"], "expand_on": [], "remove_or_rephrase": [], "search_terms": []}',
+    ])
+    reviewer = ReviewerNode(llm, cache=ResponseCache(str(tmp_path / "response.db")))
+    state = {"current_section": "Overview", "current_section_instruction": "", "current_section_content": "Revenue grew 10%."}
+
+    first = asyncio.run(reviewer.areview(state))
+    second = asyncio.run(reviewer.areview(state))
+
+    assert first["key_highlights"] == ["Revenue grew 10%"]
+    # A second LLM call would have returned the second response
+    assert second["critique"] == first["critique"]
@@ -0,0 +1,48 @@
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from langgraph.graph import END
+
+from src.agents.writer import WriterNode
+from src.graphs.main_graph import PortfolioAnalysisGraph
+from src.utils.llm_cache import ResponseCache
+
+FIRST_DRAFT_TABLE = {"title": "Draft revenue", "rows": [{"Year": "2023", "Revenue": "100"}]}
+REWRITTEN_TABLE = {"title": "Revenue", "rows": [{"Year": "2024", "Revenue": "110"}]}
+
+
+def _rewrite(tmp_path, response):
+    writer = WriterNode(FakeListChatModel(responses=[response]), cache=ResponseCache(str(tmp_path / "response.db")),
+                        rewrite_tables=True)
+    state = {
+        "current_section": "Financials",
+        "current_section_instruction": "",
+        "critique": {"key_highlights": [], "expand_on": ["revenue"], "remove_or_rephrase": [], "search_terms": []},
+        "documents": [{"filename": "a.txt", "content": "Revenue was 110 in 2024."}],
+        "current_section_content": "### Revenue\nRevenue was 100.\n\n",
+        "current_section_sub_sections": [{"title": "Revenue", "content": "Revenue was 100."}],
+        "include_table": True,
+        "include_graphs": False,
+        "graph_specs": [],
+        # Set by the SectionComposerNode from the first draft
+        "tabular_data": FIRST_DRAFT_TABLE,
+        "loop_count": 0,
+    }
+    update = asyncio.run(writer.arewrite(state))
+    return {**state, **update}
+
+
+def test_table_from_the_rewrite_replaces_the_first_draft_table(tmp_path):
+    state = _rewrite(tmp_path, '{"sub_sections": [{"title": "Revenue", "content": "Revenue grew to 110 in 2024."}], '
+                               '"tabular_data": {"title": "Revenue", "rows": [{"Year": "2024", "Revenue": "110"}]}}')
+
+    assert state["tabular_data"] == REWRITTEN_TABLE
+    assert PortfolioAnalysisGraph()._decide_table_or_graph_generation(state) == END
+
+
+def test_rewrite_without_a_table_sends_the_section_to_the_table_generator(tmp_path):
+    state = _rewrite(tmp_path, '{"sub_sections": [{"title": "Revenue", "content": "Revenue grew to 110 in 2024."}]}')
+
+    assert state["tabular_data"] is None
+    assert PortfolioAnalysisGraph()._decide_table_or_graph_generation(state) == ["table_generator"]